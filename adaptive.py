@@ -0,0 +1,115 @@
+'''
+This file implements an adaptive measurement mode for Task 1. Instead of always sampling a fixed number of
+shots, adaptive_test samples the address register in growing batches (initial_shots, then growth times more
+each batch) and, after each batch, computes a Wilson confidence interval for the probability of every address
+(Bonferroni-corrected over the 2^n addresses, so that all of them hold at once with the requested confidence).
+It stops as soon as every address is classified, i.e. its interval lies entirely above threshold (a solution)
+or entirely below it, or when max_shots is reached.
+
+The state is prepared once (the circuit is built and transpiled once, and with the sparse or MPS simulator
+simulated once); only the sampling is repeated. Batch i is sampled with seed + i, so runs are reproducible.
+
+Usage:
+    result = adaptive_test([1, 5, 7, 10])       # result['solutions'] == ['01', '11']
+'''
+
+from statistics import NormalDist
+import numpy as np
+from circuit_cache import default_cache
+from resources import estimate_resources, plan_simulation
+
+
+# Returns the Wilson confidence interval of a probability, from count successes out of shots, for the
+# quantile z of the normal distribution
+def wilson_interval(count, shots, z):
+    if shots == 0:
+        return 0.0, 1.0
+    p = count / shots
+    denominator = 1 + z ** 2 / shots
+    centre = (p + z ** 2 / (2 * shots)) / denominator
+    half_width = z * np.sqrt(p * (1 - p) / shots + z ** 2 / (4 * shots ** 2)) / denominator
+    return max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+
+# Returns a function sampling the address register of the circuit of input_vector, as sample(shots, seed)
+# returning counts like result.get_counts(), with the state prepared once on the engine chosen by
+# resources.plan_simulation
+def _sampler(input_vector, method, cache, mode, budget, optimize, exact, serial):
+    from main import prepare_circuit, resolve_strategy, _run
+    exact, serial = resolve_strategy(input_vector, mode, exact, serial)
+    report = estimate_resources(input_vector, mode, count_gates=False, optimize=optimize, exact=exact,
+                                serial=serial)
+    plan = plan_simulation(report, budget, method)
+    print("Simulating with {} (projected memory: {:.3f} GB).".format(plan['name'], plan['memory'] / 1024 ** 3))
+    options = {'cache': cache, 'mode': mode, 'optimize': optimize, 'exact': exact, 'serial': serial}
+    n = int(np.log2(len(input_vector)))
+
+    if plan['engine'] == 'mps':     # simulated once, the batches are sampled from the address probabilities
+        from mps import mps_test
+        from sparse_sim import sparse_counts
+        probabilities = mps_test(input_vector, budget=budget, **options)['probabilities']
+        state = {i: np.sqrt(p) for i, p in enumerate(probabilities) if p > 0}
+        return n, lambda shots, seed: sparse_counts(state, {i: i for i in range(n)}, n, shots, seed)
+
+    if plan['engine'] == 'sparse':
+        from sparse_sim import sparse_run, sparse_counts
+        circuit, n = prepare_circuit(input_vector, **options)
+        state, _ = sparse_run(circuit)
+        return n, lambda shots, seed: sparse_counts(state, {i: i for i in range(n)}, n, shots, seed)
+
+    from qiskit import ClassicalRegister
+    from qiskit.providers.aer import AerSimulator
+    sim = AerSimulator(method=plan['method'], precision=plan['precision'])
+    circuit, n = prepare_circuit(input_vector, sim, ('aer', plan['method'], plan['precision']), **options)
+    qc = circuit.copy()     # the cached circuit is shared, so add the measurements to a copy
+    meas = ClassicalRegister(n)
+    qc.add_register(meas)
+    qc.measure(list(range(n)), meas)
+    return n, lambda shots, seed: _run(sim, qc, shots=shots, seed_simulator=seed).get_counts()
+
+
+# Measures the address register of the circuit of input_vector in growing batches, until the solution set
+# (the addresses measured with probability above threshold) is identified with the given confidence, or
+# max_shots is reached
+# threshold defaults to 1/2^(n+1), half the uniform probability: Grover's algorithm brings each of the M
+# solutions to about 1/M >= 1/2^n (exactly 1/2^n when every address is a solution, which a threshold of 1/2^n
+# could never separate) and suppresses the other addresses well below it
+# method, cache, mode, budget, optimize, exact and serial are the same as in main.Grovers_test
+# Returns a dictionary with the counts, the number of shots used, the stopping reason ('identified' or
+# 'max_shots'), the solutions (sorted bitstrings), the confidence intervals of every address and the batches
+def adaptive_test(input_vector, confidence=0.99, threshold=None, initial_shots=100, growth=2, max_shots=8000,
+                  seed=0, method='auto', cache=default_cache, mode='bucket_brigade', budget=None, optimize=True,
+                  exact=False, serial=False):
+    n, sample = _sampler(input_vector, method, cache, mode, budget, optimize, exact, serial)
+    if threshold is None:
+        threshold = 1 / 2 ** (n + 1)
+    outcomes = [format(i, 'b').zfill(n) for i in range(2 ** n)]
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / (2 * len(outcomes)))       # two-sided, Bonferroni
+
+    counts = {}
+    shots = 0
+    batch = initial_shots
+    batches = []
+    while True:
+        batch = min(batch, max_shots - shots)
+        for outcome, count in sample(batch, seed + len(batches)).items():
+            counts[outcome] = counts.get(outcome, 0) + count
+        shots += batch
+        batches.append(batch)
+
+        intervals = {outcome: wilson_interval(counts.get(outcome, 0), shots, z) for outcome in outcomes}
+        identified = all(low > threshold or high < threshold for low, high in intervals.values())
+        if identified or shots >= max_shots:
+            break
+        batch *= growth
+
+    solutions = sorted(outcome for outcome, (low, _) in intervals.items() if low > threshold)
+    reason = 'identified' if identified else 'max_shots'
+    print("Stopped after {} shots ({}): solutions {}.".format(shots, reason, solutions))
+    return {'counts': counts, 'shots': shots, 'stopping_reason': reason, 'solutions': solutions,
+            'intervals': intervals, 'batches': batches, 'confidence': confidence, 'threshold': threshold}
+
+
+if __name__ == '__main__':
+    for vector in ([1, 5, 7, 10], [1, 5, 7, 10, 2, 3, 9, 6]):
+        print(adaptive_test(vector, method='sparse'))
@@ -0,0 +1,102 @@
+'''
+This file implements the ancilla-aware synthesis of the multi-controlled X gates in DIF, VC and SUP_2. Without
+ancillas, Qiskit decomposes an MCX over k controls into a deep, gate-heavy circuit, while with k - 2 clean
+ancillas the v-chain decomposition only needs O(k) Toffoli gates. When these gates run, many qubits of the
+circuit are known to be in a clean |0> state:
+    - during VC, the tau register of QRAM (or the flag qubit of QROM), restored by the lookup;
+    - during DIF and SUP_2, the tau and t registers, restored by the second lookup of the oracle.
+The m register (and the tc register of the parallel read-out) is clean too, but optimize.py folds its constant
+X gates and drops the cells the data leaves unused, so borrowing them would keep them in the optimized circuit
+(e.g. 14 -> 16 qubits for [1, 5, 7, 10]); only the qubits that survive optimize.py are borrowed.
+
+CleanQubits tracks which qubits are clean while the circuit is assembled, and mcx uses the borrowed ones.
+Borrowing a qubit ties the MCX to the gates around it on that qubit, so the ones idle the longest are borrowed
+first: the t register and the last tau qubits, rather than tau_0, the last qubit the lookup restores and the
+first one the next lookup uses (borrowing tau_0 first made the transpiled depth worse for n = 3, 351 -> 370).
+ancilla_report compares the transpiled circuit with and without ancillas, including the depth trade-off.
+'''
+
+from qiskit import transpile
+
+
+# Returns the number of clean ancillas worth borrowing for an MCX over k controls, out of available ones:
+# k - 2 for the v-chain decomposition, otherwise 1 for the recursive one (which only helps from 5 controls)
+def ancillas_needed(k, available):
+    if k > 2 and available >= k - 2:
+        return k - 2
+    if k > 4 and available >= 1:
+        return 1
+    return 0
+
+
+# Appends an MCX over controls onto target to circuit, using the given clean ancillas (restored afterwards)
+# through the v-chain decomposition if there are enough of them, or the recursive one with a single ancilla
+def mcx(circuit, controls, target, ancillas=()):
+    k = len(controls)
+    ancillas = list(ancillas)
+    if k > 2 and len(ancillas) >= k - 2:
+        circuit.mcx(controls, target, ancillas[:k - 2], mode='v-chain')
+    elif k > 4 and ancillas:
+        circuit.mcx(controls, target, ancillas[:1], mode='recursion')
+    else:
+        circuit.mcx(controls, target)
+
+
+# Returns the work qubits of a lookup with lookup_qubits qubits, over n address and m value qubits, that survive
+# optimize.py: the tau register (or the flag qubit of QROM), never the memory cells or the copies of t
+def surviving_work(n, m, lookup_qubits):
+    return range(n, n + min(2 ** n, lookup_qubits - n - m))
+
+
+# Returns the clean qubits of the lookup (its surviving work qubits, then possibly the t register) in the order
+# they are preferably borrowed in: the last ones first, as the lookup releases them earliest and reuses them latest
+def idle_first(qubits):
+    return list(qubits)[::-1]
+
+
+# Tracks the qubits of a circuit under assembly that are known to be in the clean |0> state
+# qubits are the initially clean ones, in the order they are preferably borrowed in
+class CleanQubits:
+    def __init__(self, qubits):
+        self.order = list(qubits)
+        self.clean = set(self.order)
+
+    # marks the qubits as dirty, e.g. the t register after the first lookup
+    def dirty(self, qubits):
+        self.clean.difference_update(qubits)
+
+    # marks the qubits as clean again, e.g. the t register after the second lookup
+    def restore(self, qubits):
+        self.clean.update(q for q in qubits if q in self.order)
+
+    # Returns the number of clean qubits
+    def available(self, exclude=()):
+        return len(self.clean.difference(exclude))
+
+    # Returns up to count clean qubits, which the caller must leave clean
+    def borrow(self, count, exclude=()):
+        exclude = set(exclude)
+        return [q for q in self.order if q in self.clean and q not in exclude][:count]
+
+
+# Returns the gate counts and depth of the circuit of input_vector transpiled into basis gates, with and without
+# ancilla-aware MCX synthesis, and the reductions
+def ancilla_report(input_vector, mode='bucket_brigade', basis_gates=('u', 'cx')):
+    from main import Grovers_circuit
+    report = {}
+    for name, ancillas in (('without', False), ('with', True)):
+        circuit, _ = Grovers_circuit(input_vector, mode, ancillas=ancillas)
+        circuit = transpile(circuit, basis_gates=list(basis_gates))
+        report[name] = {'num_qubits': circuit.num_qubits, 'size': circuit.size(), 'depth': circuit.depth(),
+                        'gate_counts': dict(circuit.count_ops())}
+    report['size_reduction'] = 1 - report['with']['size'] / report['without']['size']
+    report['depth_reduction'] = 1 - report['with']['depth'] / report['without']['depth']
+    return report
+
+
+if __name__ == '__main__':
+    for vector in ([1, 5, 7, 10], [1, 5, 7, 10, 2, 3, 9, 6]):
+        report = ancilla_report(vector)
+        print("{}: {} -> {} gates ({:+.1%}), depth {} -> {} ({:+.1%})".format(
+            vector, report['without']['size'], report['with']['size'], -report['size_reduction'],
+            report['without']['depth'], report['with']['depth'], -report['depth_reduction']))
@@ -0,0 +1,174 @@
+'''
+This file implements a batch runner that solves Task 1 for a queue of input vectors concurrently, without
+ever crossing a configurable RAM budget. Jobs range from a few MB (n = 1) to several GB (a 30-qubit
+statevector), so the memory footprint of each job is predicted from its qubit count and precision before
+it is started (see resources.py), and jobs are packed into a process pool such that the total footprint of the running jobs
+stays below the budget. Results are streamed as JSONL, one line per input vector, as soon as they complete.
+
+Usage: python batch_runner.py vectors.txt --budget 12GB --workers 4 > results.jsonl
+where each line of vectors.txt is an input vector, either as a JSON list ([1, 5, 7, 10]), a JSON object
+with an 'input_vector' field (and optionally an 'id'), or integers separated by spaces or commas.
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from resources import estimate_resources, plan_simulation
+
+
+WORKER_OVERHEAD = 400 * 1024 ** 2       # rough memory used by a worker process importing qiskit and Aer
+UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+
+# Parses a size like '12GB' or '512MB' (plain numbers are in bytes)
+def parse_size(text):
+    text = text.strip().upper()
+    for unit in sorted(UNITS, key=len, reverse=True):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * UNITS[unit])
+    return int(text)
+
+
+# Predicts the peak memory of a job in bytes, from its qubit count and the simulation method
+# (see resources.py), plus the memory used by the worker process itself
+# The final state does not add to it, as it is streamed out of the statevector (see reduced_state.py)
+def footprint(input_vector, method='auto', mode='bucket_brigade'):
+    report = estimate_resources(input_vector, mode, count_gates=False, optimize=True)
+    return WORKER_OVERHEAD + plan_simulation(report, float('inf'), method)['memory']
+
+
+# Reads the input vectors from a stream, yielding (id, input_vector) pairs
+# A line that cannot be parsed yields (index, error) instead, with the ValueError, which run_batch reports
+def read_vectors(stream):
+    for index, line in enumerate(stream):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            if line[0] in '[{':
+                data = json.loads(line)
+                if isinstance(data, dict):
+                    yield data.get('id', index), [int(v) for v in data['input_vector']]
+                else:
+                    yield index, [int(v) for v in data]
+            else:
+                yield index, [int(v) for v in line.replace(',', ' ').split()]
+        except (ValueError, TypeError, KeyError) as error:
+            yield index, ValueError("line {}: cannot parse {!r} as an input vector: {}".format(index + 1, line, error))
+
+
+# Runs one job in a worker process, returning the counts (or the final address state, as a list of the
+# [real, imaginary] parts of the amplitudes, which keeps their phases)
+def _solve(input_vector, return_state, n_shots, method, mode):
+    from main import Grovers_test
+    with contextlib.redirect_stdout(io.StringIO()):     # Grovers_test reports to stdout
+        output = Grovers_test(input_vector, return_state=return_state, n_shots=n_shots, method=method, mode=mode)
+    if return_state:
+        return {'state': [[float(amp.real), float(amp.imag)] for amp in output]}
+    return {'counts': dict(output)}
+
+
+# Solves every input vector from vectors (an iterable of (id, input_vector) pairs) concurrently, keeping the
+# predicted memory of the running jobs below budget bytes, and writes one JSON line per job to output
+# as soon as it completes. Jobs that cannot fit in the budget on their own, and vectors that cannot be parsed
+# (see read_vectors) or estimated, are reported as errors.
+# window is the number of jobs read ahead of the running ones, so that smaller jobs can fill the gaps
+# left by larger ones. Returns the number of failed jobs.
+def run_batch(vectors, budget, output=sys.stdout, max_workers=None, method='auto', return_state=False,
+              n_shots=8000, window=None, mode='bucket_brigade'):
+    max_workers = max_workers or os.cpu_count() or 1
+    window = window or 4 * max_workers
+    vectors = iter(vectors)
+    pending = []        # jobs read but not started yet, in arrival order
+    running = {}        # future -> (id, input_vector, footprint, start time)
+    in_use = 0
+    failed = 0
+    exhausted = False
+
+    def emit(record):
+        output.write(json.dumps(record) + '\n')
+        output.flush()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            while not exhausted and len(pending) < window:
+                try:
+                    job_id, input_vector = next(vectors)
+                except StopIteration:
+                    exhausted = True
+                    break
+                try:        # a bad vector only fails its own job
+                    if isinstance(input_vector, Exception):
+                        raise input_vector
+                    pending.append((job_id, input_vector, footprint(input_vector, method, mode=mode)))
+                except Exception as error:
+                    failed += 1
+                    emit({'id': job_id, 'input_vector': None if isinstance(input_vector, Exception)
+                          else input_vector, 'status': 'error', 'error': repr(error)})
+
+            # first fit: start every pending job that still fits, in arrival order
+            for job in list(pending):
+                job_id, input_vector, size = job
+                if size > budget:
+                    pending.remove(job)
+                    failed += 1
+                    emit({'id': job_id, 'input_vector': input_vector, 'status': 'error', 'footprint': size,
+                          'error': 'predicted memory exceeds the budget of {} bytes'.format(budget)})
+                elif len(running) < max_workers and in_use + size <= budget:
+                    pending.remove(job)
+                    future = pool.submit(_solve, input_vector, return_state, n_shots, method, mode)
+                    running[future] = (job_id, input_vector, size, time.time())
+                    in_use += size
+
+            if not running:
+                if exhausted and not pending:
+                    return failed
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job_id, input_vector, size, start = running.pop(future)
+                in_use -= size
+                record = {'id': job_id, 'input_vector': input_vector, 'footprint': size,
+                          'wall_time': time.time() - start}
+                try:
+                    record.update(future.result())
+                    record['status'] = 'ok'
+                except Exception as error:      # report the failure and keep going with the other jobs
+                    failed += 1
+                    record.update({'status': 'error', 'error': repr(error)})
+                emit(record)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Solve Task 1 for many input vectors under a RAM budget.")
+    parser.add_argument('vectors', nargs='?', default='-', help="file of input vectors, '-' for stdin")
+    parser.add_argument('--budget', default='8GB', help="RAM budget for all running jobs, e.g. 12GB")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes")
+    parser.add_argument('--method', default='auto', choices=['auto', 'statevector', 'sparse'])
+    parser.add_argument('--mode', default='bucket_brigade', choices=['bucket_brigade', 'qrom', 'parallel'])
+    parser.add_argument('--state', action='store_true', help="return the final state instead of counts")
+    parser.add_argument('--shots', type=int, default=8000)
+    parser.add_argument('--output', default='-', help="JSONL output file, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.vectors == '-' else open(args.vectors)
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        failed = run_batch(read_vectors(source), parse_size(args.budget), output, args.workers, args.method,
+                           return_state=args.state, n_shots=args.shots, mode=args.mode)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+'''
+This file implements a reproducible benchmark suite for the circuit solving Task 1. It sweeps n and m
+(covering n = 1, the n = 2 path through from2to4.improve, and the standard Grover's path for n >= 3) and
+benchmarks the pipeline Grovers_test actually runs: main.prepare_circuit (Grovers_circuit, optimize.py and,
+for Aer, transpile) into a fresh circuit cache, the same call again as a cache hit, and the run of the engine
+resources.plan_simulation selects (sparse, statevector or matrix_product_state). The stages inside the cold
+prepare_circuit (Grovers_circuit, oracle_circuit, to_gate, optimize, transpile, ...) are timed through the
+events of instrument.py, and the peak memory is recorded as well. Every (n, m) point runs in a fresh process, so
+that its peak RSS is not polluted by the previous ones, and the input vectors are generated from a fixed seed.
+The stages are timed with tracemalloc off; the peak Python memory is measured on one more, untimed run. A
+point that fails (e.g. runs out of memory) is recorded with its error instead of aborting the sweep, and a
+point no engine fits in the budget is only prepared, not simulated.
+
+Usage:
+    python benchmark.py run --n 2 3 --m 2 3 4 --output bench.json
+    python benchmark.py compare baseline.json bench.json --threshold 0.2
+where compare flags every stage that got slower (or used more memory) by more than the threshold.
+'''
+
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import instrument
+from instrument import peak_rss_kb
+
+
+# Returns a deterministic input vector of length 2^n whose largest value has exactly m bits
+def benchmark_vector(n, m, seed=0):
+    rng = random.Random(seed * 1000 + n * 10 + m)
+    vector = [rng.randrange(2 ** m) for _ in range(2 ** n)]
+    vector[rng.randrange(2 ** n)] = rng.randrange(2 ** (m - 1), 2 ** m)
+    return vector
+
+
+# Runs the pipeline once for input_vector with the simulation plan of resources.plan_simulation (None to only
+# prepare the circuit), returning the wall time of each stage in seconds
+def _run_stages(input_vector, mode, n_shots, plan):
+    from qiskit import ClassicalRegister
+    from circuit_cache import CircuitCache
+    from main import prepare_circuit
+    from sparse_sim import sparse_run, sparse_counts
+
+    cache = CircuitCache(directory=None)       # in memory only, so the first call always builds
+    sim, target = None, 'sparse'
+    if plan is not None and plan['engine'] == 'aer':
+        from qiskit.providers.aer import AerSimulator
+        sim = AerSimulator(method=plan['method'], precision=plan['precision'])
+        target = ('aer', plan['method'], plan['precision'])
+
+    times = {}
+    events = []
+    instrument.enable(events.append)
+    try:
+        start = time.perf_counter()
+        circuit, n = prepare_circuit(input_vector, sim, target, cache, mode)
+        times['prepare_circuit'] = time.perf_counter() - start
+    finally:
+        instrument.disable()
+    for event in events:        # the stages inside prepare_circuit
+        times[event['stage']] = times.get(event['stage'], 0.0) + event['wall_time']
+
+    start = time.perf_counter()
+    prepare_circuit(input_vector, sim, target, cache, mode)
+    times['prepare_circuit (cached)'] = time.perf_counter() - start
+
+    if plan is None:
+        return times
+    start = time.perf_counter()
+    if plan['engine'] == 'sparse':
+        state, _ = sparse_run(circuit)
+        sparse_counts(state, {i: i for i in range(n)}, n, n_shots)
+    elif plan['engine'] == 'mps':
+        from mps import mps_test
+        mps_test(input_vector, n_shots=n_shots, cross_check=False, cache=cache, mode=mode)
+    else:
+        qc = circuit.copy()
+        meas = ClassicalRegister(n)
+        qc.add_register(meas)
+        qc.measure(list(range(n)), meas)
+        sim.run(qc, shots=n_shots).result().get_counts()
+    times['sim.run'] = time.perf_counter() - start
+    return times
+
+
+# Benchmarks one (n, m) point, meant to run in a fresh process
+def _benchmark_point(n, m, mode, repeat, n_shots, budget, seed, method='auto'):
+    import contextlib
+    import io
+    from resources import estimate_resources, plan_simulation, InsufficientMemoryError
+
+    input_vector = benchmark_vector(n, m, seed)
+    report = estimate_resources(input_vector, mode, count_gates=False, optimize=True)
+    try:
+        plan = plan_simulation(report, budget, method)
+    except InsufficientMemoryError:
+        plan = None
+
+    point = {'n': n, 'm': m, 'mode': mode, 'input_vector': input_vector, 'num_qubits': report['num_qubits'],
+             'simulated': plan is not None, 'engine': plan and plan['name']}
+    runs = []
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(repeat):
+                runs.append(_run_stages(input_vector, mode, n_shots, plan))
+            tracemalloc.start()     # not during the timed runs, as tracing slows every allocation down
+            try:
+                _run_stages(input_vector, mode, n_shots, plan)
+                _, python_peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+    except Exception as error:      # record the failure and go on with the next points
+        point.update({'error': repr(error), 'stages': {}, 'peak_rss_kb': peak_rss_kb()})
+        return point
+
+    stages = {}
+    for stage in dict.fromkeys(stage for run in runs for stage in run):
+        samples = [run.get(stage, 0.0) for run in runs]     # e.g. DIF is only synthesized once per process
+        stages[stage] = {'times': samples, 'median': statistics.median(samples), 'min': min(samples)}
+    point.update({'stages': stages, 'peak_rss_kb': peak_rss_kb(), 'python_peak_bytes': python_peak})
+    return point
+
+
+# Runs the benchmark over every (n, m) pair, each in a fresh process, and returns the results (the failed
+# points have an 'error' and no stages)
+# method restricts the engines resources.plan_simulation chooses from, like in main.Grovers_test
+def run_benchmark(ns, ms, mode='bucket_brigade', repeat=3, n_shots=1000, budget=None, seed=0, method='auto'):
+    import qiskit
+    results = {'meta': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'qiskit': getattr(qiskit, '__version__', None), 'timestamp': time.time(),
+                        'repeat': repeat, 'n_shots': n_shots, 'seed': seed, 'method': method},
+               'results': []}
+    context = multiprocessing.get_context('spawn')
+    for n in ns:
+        for m in ms:
+            try:
+                with context.Pool(1, maxtasksperchild=1) as pool:
+                    point = pool.apply(_benchmark_point, (n, m, mode, repeat, n_shots, budget, seed, method))
+            except Exception as error:      # e.g. the process could not be started
+                point = {'n': n, 'm': m, 'mode': mode, 'error': repr(error), 'stages': {}}
+            results['results'].append(point)
+            if 'error' in point:
+                print("n = {}, m = {}: FAILED {}".format(n, m, point['error']), file=sys.stderr)
+                continue
+            print("n = {}, m = {}: ".format(n, m) + ", ".join(
+                "{} {:.4f}s".format(stage, data['median']) for stage, data in point['stages'].items()),
+                file=sys.stderr)
+    return results
+
+
+# Compares two benchmark results, returning the list of regressions: the stages whose median time (or the
+# points whose peak memory) grew by more than threshold (relative), ignoring changes below min_seconds
+def compare(baseline, current, threshold=0.2, min_seconds=1e-3):
+    base_points = {(p['n'], p['m'], p['mode']): p for p in baseline['results']}
+    regressions = []
+    for point in current['results']:
+        base = base_points.get((point['n'], point['m'], point['mode']))
+        if base is None:
+            continue
+        for stage, data in point['stages'].items():
+            if stage not in base['stages']:
+                continue
+            old, new = base['stages'][stage]['median'], data['median']
+            if new - old > min_seconds and new > old * (1 + threshold):
+                regressions.append((point['n'], point['m'], stage, old, new))
+        for key in ('peak_rss_kb', 'python_peak_bytes'):
+            old, new = base.get(key), point.get(key)
+            if old and new and new > old * (1 + threshold):
+                regressions.append((point['n'], point['m'], key, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the construction and simulation of the circuit.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run')
+    run.add_argument('--n', type=int, nargs='+', default=[1, 2, 3])
+    run.add_argument('--m', type=int, nargs='+', default=[2, 3, 4])      # m = 1 has no VC to build
+    run.add_argument('--mode', default='bucket_brigade', choices=['bucket_brigade', 'qrom', 'parallel'])
+    run.add_argument('--repeat', type=int, default=3)
+    run.add_argument('--shots', type=int, default=1000)
+    run.add_argument('--method', default='auto',
+                     choices=['auto', 'statevector', 'sparse', 'matrix_product_state'])
+    run.add_argument('--budget', type=float, default=None, help="memory budget for sim.run in GB")
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--output', default='bench.json')
+    cmp = commands.add_parser('compare')
+    cmp.add_argument('baseline')
+    cmp.add_argument('current')
+    cmp.add_argument('--threshold', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        budget = None if args.budget is None else int(args.budget * 1024 ** 3)
+        results = run_benchmark(args.n, args.m, args.mode, args.repeat, args.shots, budget, args.seed,
+                                args.method)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    for n, m, stage, old, new in regressions:
+        print("REGRESSION n = {}, m = {}, {}: {:.4g} -> {:.4g} ({:+.1%})".format(n, m, stage, old, new, new / old - 1))
+    if not regressions:
+        print("No regression above {:.0%}.".format(args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+'''
+This file implements a checkpointed, resumable simulation of the circuit solving Task 1. Instead of running
+the whole circuit at once (and losing everything if a 30-qubit run fails halfway), the circuit of
+Grovers_circuit is split into segments, the preparation of |s> and then one ORACLE + DIF iteration each (plus
+SUP_2 for n = 2), which are simulated one after the other with the dense AerSimulator. Like
+main.prepare_circuit, the circuit first goes through the pass in optimize.py (which drops the m register, e.g.
+39 -> 15 qubits for [1, 2, 5, 7, 0, 3, 2, 1]), with barriers between the segments so that it can be split back.
+
+After each segment, the statevector is written to a memory-mapped .npy file (in single or double precision),
+and the probabilities of the address register (the first n qubits) and the success probability, i.e. the
+probability of measuring a solution address, are recorded in manifest.json. A run started again on the same
+directory resumes from the last checkpoint. Snapshots are read back as read-only memory maps, so they can be
+inspected chunk by chunk (see reduced_state.py) without loading them fully into RAM, and each segment starts
+from the memory map of the previous snapshot, in its own dtype, rather than from a copy of the statevector.
+
+Usage: python checkpoint.py run_dir 1 5 7 10 [--precision double] [--exact] [--no-optimize]
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from qiskit import QuantumCircuit, transpile
+from circuit_cache import component_version
+from logical_grover import marked_addresses
+from optimize import optimize_circuit
+from reduced_state import reduced_address_state
+
+
+MANIFEST = 'manifest.json'
+DTYPES = {'single': np.complex64, 'double': np.complex128}
+# the tolerance of Aer on the norm of the state of set_statevector, loose enough for the rounding of a
+# single-precision snapshot, so that it needs no renormalized copy
+VALIDATION_THRESHOLDS = {'single': 1e-5, 'double': 1e-8}
+SEGMENT_ENDS = ('DIF', 'DIF_phase')     # labels of the gates ending an iteration
+
+
+# Splits the circuit into segments: the leading 1-qubit gates (the preparation), then one segment per
+# iteration, ending with a DIF gate, and the remaining gates (e.g. SUP_2) if any
+# Returns a list of (name, segment circuit)
+def iteration_segments(circuit):
+    segments = []
+    current = QuantumCircuit(*circuit.qregs, global_phase=circuit.global_phase)
+    name = 'prepare'
+    for op, qargs, cargs in circuit.data:
+        if name == 'prepare' and op.num_qubits > 1:
+            segments.append((name, current))
+            current = QuantumCircuit(*circuit.qregs)
+            name = 'iteration {}'.format(len(segments))
+        current.append(op, qargs, cargs)
+        if getattr(op, 'label', None) in SEGMENT_ENDS:
+            segments.append((name, current))
+            current = QuantumCircuit(*circuit.qregs)
+            name = 'iteration {}'.format(len(segments))
+    if current.data or not segments:
+        if name != 'prepare':
+            name = ', '.join(getattr(op, 'label', None) or op.name for op, _, _ in current.data)
+        segments.append((name, current))
+    return segments
+
+
+# Runs the pass in optimize.py over the segments as a whole, keeping the first n qubits, with a barrier between
+# consecutive segments so that no gate is folded or cancelled across them; returns the optimized segments
+def optimize_segments(segments, n):
+    joined = QuantumCircuit(*segments[0][1].qregs)
+    for index, (_, segment) in enumerate(segments):
+        if index:
+            joined.barrier()
+        joined.compose(segment, inplace=True)
+    optimized, _, _ = optimize_circuit(joined, keep=range(n), keep_barriers=True)
+    result = []
+    current = QuantumCircuit(optimized.num_qubits, global_phase=optimized.global_phase)
+    for op, qargs, cargs in optimized.data:
+        if op.name == 'barrier':
+            result.append(current)
+            current = QuantumCircuit(optimized.num_qubits)
+        else:
+            current.append(op, qargs, cargs)
+    result.append(current)
+    return [(name, segment) for (name, _), segment in zip(segments, result)]
+
+
+def _write_json(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+# Returns the manifest of the run in directory, or None if there is none
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+# Returns the statevector after the given checkpoint (default: the last one) as a read-only memory map
+def snapshot(directory, index=-1):
+    manifest = load_manifest(directory)
+    if not manifest or not manifest['checkpoints']:
+        raise FileNotFoundError("No checkpoint in '{}'".format(directory))
+    record = manifest['checkpoints'][index]
+    return np.load(os.path.join(directory, record['file']), mmap_mode='r')
+
+
+# Inspects a snapshot chunk by chunk, returning the reduced address state (see reduced_state.py) and the
+# success probability, without loading the statevector into RAM
+def inspect_snapshot(directory, index=-1):
+    manifest = load_manifest(directory)
+    state = snapshot(directory, index)
+    reduced = reduced_address_state(state, manifest['n'])
+    marked = marked_addresses(manifest['input_vector'])[0]
+    reduced['success_probability'] = float(np.sum(reduced['probabilities'][marked]))
+    return reduced
+
+
+# Writes the statevector to a memory-mapped .npy file, going through a temporary file so that a crash
+# never leaves a truncated snapshot behind
+def _save_snapshot(path, state, dtype):
+    mapped = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=dtype, shape=state.shape)
+    mapped[:] = state
+    mapped.flush()
+    del mapped
+    os.replace(path + '.tmp', path)
+
+
+# Runs the circuit of input_vector segment by segment, checkpointing into directory after each of them
+# precision is 'single' or 'double', for both the simulation and the snapshots
+# If resume and directory already holds checkpoints of the same run, the simulation starts from the last one
+# (a ValueError is raised if they belong to a different run)
+# keep_snapshots=False only keeps the last snapshot on disk
+# If optimize, the segments go through the pass in optimize.py (see optimize_segments)
+# Returns the manifest, whose 'checkpoints' list the success probability after each segment
+def run_checkpointed(input_vector, directory, precision='single', mode='bucket_brigade', exact=False,
+                     resume=True, keep_snapshots=True, optimize=True):
+    from qiskit.providers.aer import AerSimulator
+    from main import Grovers_circuit
+
+    os.makedirs(directory, exist_ok=True)
+    circuit, n = Grovers_circuit(input_vector, mode, exact)
+    segments = iteration_segments(circuit)
+    if optimize:
+        segments = optimize_segments(segments, n)
+    run = {'input_vector': [int(v) for v in input_vector], 'mode': mode, 'exact': exact, 'precision': precision,
+           'optimize': optimize, 'num_qubits': segments[0][1].num_qubits, 'n': n, 'version': component_version()}
+
+    manifest = load_manifest(directory) if resume else None
+    if manifest is not None:
+        if {key: manifest.get(key) for key in run} != run:
+            raise ValueError("The checkpoints in '{}' belong to a different run".format(directory))
+    else:
+        manifest = dict(run, segments=[name for name, _ in segments], checkpoints=[])
+        _write_json(os.path.join(directory, MANIFEST), manifest)
+
+    state = None
+    done = len(manifest['checkpoints'])
+    if done:
+        print("Resuming after checkpoint {} ({}).".format(done - 1, manifest['checkpoints'][-1]['segment']))
+        state = snapshot(directory)
+
+    sim = AerSimulator(method='statevector', precision=precision,
+                       validation_threshold=VALIDATION_THRESHOLDS[precision])
+    marked = marked_addresses(input_vector)[0]
+    for index in range(done, len(segments)):
+        name, segment = segments[index]
+        start = time.time()
+        qc = QuantumCircuit(*segment.qregs)
+        if state is not None:       # the memory-mapped snapshot itself (read in place in double precision)
+            qc.set_statevector(state)
+        qc.compose(transpile(segment, sim), inplace=True)
+        qc.save_statevector()
+        del state
+        state = np.asarray(sim.run(qc).result().data(0)['statevector'])
+
+        filename = 'state_{:03d}.npy'.format(index)
+        _save_snapshot(os.path.join(directory, filename), state, DTYPES[precision])
+        del state       # the next segment starts from the snapshot, with the checkpoint dtype
+        state = np.load(os.path.join(directory, filename), mmap_mode='r')
+        reduced = reduced_address_state(state, n)
+        record = {'index': index, 'segment': name, 'file': filename, 'wall_time': time.time() - start,
+                  'success_probability': float(np.sum(reduced['probabilities'][marked])),
+                  'address_probabilities': [float(p) for p in reduced['probabilities']]}
+        if not keep_snapshots and manifest['checkpoints']:
+            previous = os.path.join(directory, manifest['checkpoints'][-1]['file'])
+            if os.path.exists(previous):
+                os.remove(previous)
+        manifest['checkpoints'].append(record)
+        _write_json(os.path.join(directory, MANIFEST), manifest)
+        print("Checkpoint {} ({}): success probability {:.6f}".format(index, name, record['success_probability']))
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate the circuit one iteration at a time, with checkpoints.")
+    parser.add_argument('directory')
+    parser.add_argument('input_vector', type=int, nargs='+')
+    parser.add_argument('--precision', default='single', choices=['single', 'double'])
+    parser.add_argument('--mode', default='bucket_brigade', choices=['bucket_brigade', 'qrom', 'parallel'])
+    parser.add_argument('--exact', action='store_true', help="use the exact amplitude amplification")
+    parser.add_argument('--restart', action='store_true', help="ignore the existing checkpoints")
+    parser.add_argument('--no-optimize', action='store_true', help="skip the pass in optimize.py")
+    args = parser.parse_args(argv)
+    run_checkpointed(args.input_vector, args.directory, args.precision, args.mode, args.exact,
+                     resume=not args.restart, optimize=not args.no_optimize)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+'''
+This file implements a two-tier cache for built and transpiled circuits, so that repeated (or similar) calls
+of Grovers_test can skip the construction of ORACLE/DIF/SUP_2 and the transpilation altogether.
+    - The first tier is a bounded in-memory LRU, for calls within the same process.
+    - The second tier is a persistent on-disk store of QPY files with size-based eviction (the least recently
+      used files are removed first), for fresh processes.
+
+Keys are built from (input_vector, n, m, VC type, simulator target). Every key also carries the version of
+the component definitions (a hash of the source files building the circuits), so circuits built by older
+definitions are never returned; invalidate() can also be called explicitly to clear both tiers.
+
+The cache directory is only created by the first circuit stored on disk. QPY files are written to a temporary
+file and renamed into place, so a reader never sees a partial file, and a file that fails to load is treated
+as a miss and removed.
+'''
+
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+from qiskit import qpy
+
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.circuit_cache')
+# source files whose content determines the circuits
+COMPONENT_FILES = ['oracle.py', 'diffuser.py', 'from2to4.py', 'main.py', 'ancilla.py', 'divide_check.py',
+                   'components.py', 'optimize.py', 'logical_grover.py']
+
+
+# Returns a hash of the source files defining the components of the circuits
+def component_version():
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in COMPONENT_FILES:
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+# Returns the cache key of the circuit for input_vector on the given simulator target
+# options are any other settings the circuit depends on (e.g. the QRAM mode)
+def circuit_key(input_vector, target, **options):
+    n = int(len(input_vector)).bit_length() - 1
+    m = int(max(input_vector)).bit_length()
+    if n == 1:
+        vc_type = None
+    elif n == 2:
+        vc_type = '1+2'     # from2to4.improve uses VC_1 and VC_2
+    else:
+        vc_type = 0
+    return (tuple(int(v) for v in input_vector), n, m, vc_type, target) + tuple(sorted(options.items()))
+
+
+class CircuitCache:
+    # max_entries bounds the in-memory LRU, max_disk_bytes bounds the total size of the QPY files
+    # directory=None disables the on-disk tier
+    def __init__(self, max_entries=32, directory=CACHE_DIR, max_disk_bytes=2 * 1024 ** 3):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.version = component_version()
+        self.memory = OrderedDict()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0, 'load_errors': 0}
+        self._disk_ready = False
+
+    # Returns whether the on-disk tier can be used, checking its version on first use; the directory is only
+    # created if create (i.e. when a circuit is about to be stored)
+    def _disk(self, create=False):
+        if self.directory is None:
+            return False
+        if not self._disk_ready:
+            if not os.path.isdir(self.directory):
+                if not create:
+                    return False
+                os.makedirs(self.directory, exist_ok=True)
+            self._check_version()
+            self._disk_ready = True
+        return True
+
+    # clears the on-disk tier if it was written by different component definitions
+    def _check_version(self):
+        version_file = os.path.join(self.directory, 'VERSION')
+        if os.path.exists(version_file):
+            with open(version_file) as f:
+                if f.read().strip() == self.version:
+                    return
+        self._clear_disk()
+        with open(version_file, 'w') as f:
+            f.write(self.version)
+
+    def _clear_disk(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.qpy'):
+                os.remove(os.path.join(self.directory, name))
+
+    def _path(self, key):
+        name = hashlib.sha256(repr((self.version, key)).encode()).hexdigest()
+        return os.path.join(self.directory, name + '.qpy')
+
+    def _remember(self, key, circuit):
+        self.memory[key] = circuit
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    # removes the least recently used QPY files until the on-disk tier fits in max_disk_bytes
+    def _evict_disk(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.qpy'):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            total -= size
+            self.counters['evictions'] += 1
+
+    # Returns the circuit stored under key, calling build() to create it (and storing it) on a miss
+    # The returned circuit is shared, so it must be copied before being modified
+    def get(self, key, build):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.counters['memory_hits'] += 1
+            return self.memory[key]
+
+        if self._disk():
+            circuit = self._load(self._path(key))
+            if circuit is not None:
+                self.counters['disk_hits'] += 1
+                self._remember(key, circuit)
+                return circuit
+
+        self.counters['misses'] += 1
+        circuit = build()
+        self._remember(key, circuit)
+        if self._disk(create=True):
+            self._store(self._path(key), circuit)
+            self._evict_disk()
+        return circuit
+
+    # Returns the circuit of the QPY file at path, or None if there is none or it cannot be loaded (e.g.
+    # truncated, or written by another version of qiskit), in which case the file is removed
+    def _load(self, path):
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                circuit = qpy.load(f)[0]
+        except Exception:       # any failure of the file is a miss
+            self.counters['load_errors'] += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        os.utime(path)      # marks the file as recently used
+        return circuit
+
+    # Writes circuit to the QPY file at path, through a temporary file renamed into place
+    def _store(self, path, circuit):
+        descriptor, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as f:
+                qpy.dump(circuit, f)
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    # Clears both tiers, to be called whenever the component definitions change
+    def invalidate(self):
+        self.memory.clear()
+        self.version = component_version()
+        if self._disk():
+            self._clear_disk()
+            with open(os.path.join(self.directory, 'VERSION'), 'w') as f:
+                f.write(self.version)
+
+    # Returns the hit/miss counters
+    def stats(self):
+        stats = dict(self.counters)
+        stats['hits'] = stats['memory_hits'] + stats['disk_hits']
+        stats['entries'] = len(self.memory)
+        return stats
+
+
+default_cache = CircuitCache()      # shared by Grovers_test
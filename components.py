@@ -0,0 +1,98 @@
+'''
+This file implements a process-wide library of the small, fixed-size building blocks of the circuit: DIF,
+SUP, its controlled versions (CSUP and CCSUP) and SUP_2. Their unitary only depends on n (and on the number of
+ancillas they borrow), not on the input vector, so each of them is synthesized once per process: the circuit
+is built, controlled if needed (the generic control synthesis of SUP is the most expensive step), transpiled
+into BASIS_GATES and turned into a gate, and every later call gets a shared reference to the same gate.
+Grovers_circuit, improve and superpose_2 take their blocks from here, so neither the construction nor the
+transpilation of the overall circuit synthesizes them again.
+
+After fuse() (or with fused=True), a block of at most FUSE_LIMIT qubits is instead stored as a single
+UnitaryGate, which the simulators apply as one small matrix. The default is part of the key of the circuits
+in the circuit cache, and clear() also invalidates that cache.
+'''
+
+import threading
+from qiskit import transpile
+from qiskit.circuit.library import UnitaryGate
+from qiskit.quantum_info import Operator
+import instrument
+
+
+BASIS_GATES = ['u', 'cx']
+FUSE_LIMIT = 6      # the largest block (in qubits) stored as a single unitary
+
+_library = {}       # the synthesized gates, keyed by (label, parameters..., fused)
+_lock = threading.Lock()
+_fused = False      # the default of fused
+
+
+# Makes the blocks default to fused unitaries (or back to basis gates)
+def fuse(enabled=True):
+    global _fused
+    _fused = enabled
+
+
+# Returns whether the blocks default to fused unitaries (part of the key of main.prepare_circuit in the
+# circuit cache)
+def fused():
+    return _fused
+
+
+# Returns the gate of the circuit returned by build(), synthesized once per process and key
+# If fused and the circuit has at most FUSE_LIMIT qubits, the gate is a UnitaryGate, otherwise the circuit is
+# transpiled into BASIS_GATES
+def component(key, label, build, fused=False):
+    key += (fused,)
+    with _lock:
+        if key in _library:
+            return _library[key]
+    with instrument.stage('compile', gates=label) as s:
+        circuit = build()
+        if fused and circuit.num_qubits <= FUSE_LIMIT:
+            gate = UnitaryGate(Operator(circuit), label=label)
+        else:
+            compiled = transpile(circuit, basis_gates=BASIS_GATES, optimization_level=3)
+            compiled.name = label
+            s.circuit(compiled)
+            gate = compiled.to_gate(label=label)
+    with _lock:
+        return _library.setdefault(key, gate)
+
+
+# Returns the 'DIF' gate for n address qubits, with n_ancillas clean ancillas (see diffuser.diffuser_circuit)
+def diffuser_gate(n, n_ancillas=0, fused=None):
+    from diffuser import diffuser_circuit
+    fused = _fused if fused is None else fused
+    return component(('DIF', n, n_ancillas), 'DIF', lambda: diffuser_circuit(n, n_ancillas), fused)
+
+
+# Returns the 'SUP' gate controlled by controls qubits (0 for SUP itself, 1 for CSUP, 2 for CCSUP)
+def sup_gate(controls=0, fused=None):
+    from from2to4 import superpose
+    fused = _fused if fused is None else fused
+    label = ('', 'C', 'CC')[controls] + 'SUP'
+
+    def build():
+        circuit = superpose()
+        if controls:
+            with instrument.stage('control', gates='SUP'):
+                controlled = circuit.to_gate(label='SUP').control(controls)
+            circuit = controlled.definition
+        return circuit
+    return component(('SUP', controls), label, build, fused)
+
+
+# Returns the 'SUP_2' gate, with n_ancillas clean ancillas (see from2to4.superpose_2)
+def sup_2_gate(n_ancillas=0, fused=None):
+    from from2to4 import superpose_2
+    fused = _fused if fused is None else fused
+    return component(('SUP_2', n_ancillas), 'SUP_2', lambda: superpose_2(n_ancillas), fused)
+
+
+# Clears the library, e.g. after the component definitions have changed, and the circuit cache built from it
+def clear():
+    from circuit_cache import default_cache
+    with _lock:
+        _library.clear()
+    default_cache.invalidate()
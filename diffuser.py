@@ -8,20 +8,23 @@ The overall effect of this transformation is a reflection about |s> because two
 definitely makes up a reflection, and |s> does not change after the transformation.
 '''
 
-from qiskit import Aer, QuantumCircuit, assemble, transpile, QuantumRegister, ClassicalRegister
-from qiskit.providers.aer import AerSimulator
-from qiskit.visualization import plot_histogram
-import matplotlib.pyplot as plt
+from qiskit import QuantumCircuit, transpile
+import rendering
+import instrument
+import ancilla
 import numpy as np
 
 
-# Accepts n, the number of address qubits
+# Accepts n, the number of address qubits, and n_ancillas, the number of clean ancillas the MCX can use
+# (see ancilla.py)
 # Returns DF_circ, a QuantumCircuit that acts as a diffuser for an address state
-def diffuser_circuit(n):
-    DF_circ = QuantumCircuit(n+1)
+@instrument.traced('DIF')
+def diffuser_circuit(n, n_ancillas=0):
+    DF_circ = QuantumCircuit(n+1+n_ancillas)
     # qubit 0~n-1 are connected to address qubits of the oracle circuit
     # qubit n is connected to the phase qubit of the oracle circuit, in order to
     # reuse the qubit in |-> state from before
+    # the remaining qubits are clean ancillas, left in |0>
 
     # Step 1: rotates |s> to |00...0>
     for i in range(n):
@@ -30,8 +33,8 @@ def diffuser_circuit(n):
     # Step 2: reflects about |00...0>
     for j in range(n+1):     
         DF_circ.x(j)    # where a pi phase is first added to the phase qubit
-    DF_circ.mcx(list(range(n)), n)      # the extra phase is removed only if qubit 0~n-1 were initially
-                                        # in state |00...0>
+    ancilla.mcx(DF_circ, list(range(n)), n, range(n+1, n+1+n_ancillas))
+    # the extra phase is removed only if qubit 0~n-1 were initially in state |00...0>
     for k in range(n):
         DF_circ.x(k)    # recovers the initial state of qubit 0~n-1
     
@@ -40,14 +43,41 @@ def diffuser_circuit(n):
     for l in range(n):
         DF_circ.h(l)
     
-    DF_circ.draw()
-    plt.title("The diffuser circuit, with {} address qubits; 'DIF' gate".format(n))
-    plt.savefig('.\circuit_diagrams\diffuser.svg')
+    rendering.request(DF_circ, "The diffuser circuit, with {} address qubits; 'DIF' gate".format(n), 'diffuser.svg')
+    return DF_circ
+
+
+# Accepts n, the number of address qubits, and phase
+# Returns a QuantumCircuit on the n address qubits only, that applies (1 - e^(i*phase))|s><s| - I
+# (phase = pi gives the same reflection 2|s><s| - I as diffuser_circuit, without the phase qubit)
+@instrument.traced('DIF_phase')
+def phase_diffuser_circuit(n, phase=np.pi):
+    DF_circ = QuantumCircuit(n, global_phase=np.pi)     # the -1 in front of I - (1 - e^(i*phase))|s><s|
+
+    # Step 1: rotates |s> to |11...1>
+    for i in range(n):
+        DF_circ.h(i)
+        DF_circ.x(i)
+
+    # Step 2: adds the phase to |11...1>
+    if n == 1:
+        DF_circ.p(phase, 0)
+    else:
+        DF_circ.mcp(phase, list(range(n - 1)), n - 1)
+
+    # Step 3: rotates |11...1> back to |s>
+    for l in range(n):
+        DF_circ.x(l)
+        DF_circ.h(l)
+
+    rendering.request(DF_circ, "The phase diffuser circuit, with {} address qubits; 'DIF_phase' gate".format(n),
+                      'diffuser_phase.svg')
     return DF_circ
 
 
 # Accepts n as the number of address qubits and tests the diffuser circuit
 def DF_test(n):
+    from qiskit.providers.aer import AerSimulator
     initial_state = list(np.array([1, 1, -1, 1, 0, 0, 0, 0]) / 2)
     test_circ = QuantumCircuit(n+1)
     test_circ.initialize(initial_state)
@@ -56,7 +86,8 @@ def DF_test(n):
     DF = diffuser_circuit(n)
     test_circ.barrier()
     qc = test_circ.compose(DF)
-    qc.draw()
+    import matplotlib.pyplot as plt
+    qc.draw(output='mpl')
     plt.show()
     qc.save_statevector()
     
@@ -0,0 +1,129 @@
+'''
+This file generalizes the idea of from2to4.improve into a serial divide-and-check engine for any n. The
+solutions of Task 1 fall into two distinguishable classes, the alternating values starting with 0 (VC type 1)
+and the ones starting with 1 (VC type 2). Instead of doubling the search space by doubling the input vector
+(which doubles the QRAM), a single class flag qubit is added to the search: the oracle checks the class the
+flag selects, and the exact amplitude amplification of main.exact_circuit runs over the address and the flag,
+so the solutions are reached with probability 1 whatever their number in each class, with the flag holding
+their class. The QRAM is only queried on the n address qubits.
+
+This saves qubits over the doubled search space, but not over exact mode (main.exact_circuit), which reaches
+the solutions of both classes with probability 1 as well, on one qubit fewer (26 against 27 qubits for
+[1, 5, 7, 10]): what the engine adds is the class of each solution, held by the flag.
+
+Grovers_circuit(input_vector, serial=True) builds the circuit of this engine. choose_strategy compares it with
+the standard Grover's circuit and exact mode, and Grovers_test(input_vector, serial='auto') uses its choice.
+verify_serial checks the engine against the logical model of logical_grover.py.
+'''
+
+import numpy as np
+from qiskit import QuantumCircuit, QuantumRegister
+from oracle import phase_oracle_circuit
+from diffuser import phase_diffuser_circuit
+from logical_grover import marked_addresses, logical_test
+import instrument
+import rendering
+
+
+# Returns the number of solutions of each VC class (type 1 and type 2) of input_vector
+def class_counts(input_vector):
+    return {vc_type: int(np.sum(marked_addresses(input_vector, vc_type))) for vc_type in (1, 2)}
+
+
+# Returns the circuit of the serial divide-and-check engine for input_vector, whose first n qubits (register b)
+# end up in the solutions, each measured with probability 1/M
+# The class flag f (qubit n) selects the class the oracle checks: the solutions of type 1 if f is |0>, and of
+# type 2 if it is |1> (see oracle.phase_VC_circuit). The exact amplitude amplification runs over the pairs
+# |f>|b>, whose M solutions are the addresses of either class with the flag of their class, so every solution
+# address ends up with probability 1/M, and f holds its class. Unlike combining two separate searches, this
+# is correct whatever the number of solutions of each class.
+# If a class has no solution, the flag is not needed and only that class is searched
+@instrument.traced()
+def serial_circuit(input_vector, mode='bucket_brigade'):
+    from main import exact_schedule
+    n = int(np.log2(len(input_vector)))
+    m = int(np.log2(max(input_vector))) + 1
+    counts = class_counts(input_vector)
+    classes = [vc_type for vc_type in (1, 2) if counts[vc_type]]
+    flagged = len(classes) == 2
+
+    lookup_qubits = phase_oracle_circuit(input_vector, np.pi, mode).num_qubits
+    n_work = lookup_qubits - n - m
+    b = QuantumRegister(n, name='b')
+    f = QuantumRegister(1, name='f')
+    if n_work == 2**n + m * 2**n:       # the Bucket-Brigade QRAM
+        work_registers = [QuantumRegister(2**n, name='tau'), QuantumRegister(m * 2**n, name='m')]
+    else:
+        work_registers = [QuantumRegister(n_work, name='w')] if n_work else []
+    t = QuantumRegister(m, name='t')
+    searched = [b, f] if flagged else [b]
+    qc = QuantumCircuit(*searched, *work_registers, t)
+    work = [q for register in work_registers for q in register]
+    address = [q for register in searched for q in register]
+    wires = list(b) + work + list(t) + (list(f) if flagged else [])
+
+    def oracle(phase, label):
+        vc_type = 1 if flagged else (classes[0] if classes else 0)
+        return phase_oracle_circuit(input_vector, phase, mode, vc_type, flagged).to_gate(label=label)
+
+    for register in searched:
+        qc.h(register)
+    k, oracle_phase, diffuser_phase = exact_schedule(len(address), sum(counts.values()))
+    if k:
+        standard = oracle(np.pi, 'ORACLE')
+        dif = phase_diffuser_circuit(len(address), np.pi).to_gate(label='DIF')
+    for _ in range(k):
+        qc.append(standard, wires)
+        qc.append(dif, address)
+    if oracle_phase is not None:
+        qc.append(oracle(oracle_phase, 'ORACLE_phase'), wires)
+        qc.append(phase_diffuser_circuit(len(address), diffuser_phase).to_gate(label='DIF_phase'), address)
+
+    rendering.request(qc, "Serial divide-and-check circuit for input_vector " + str(input_vector), 'serial.svg')
+    return qc
+
+
+# Checks serial_circuit against the logical model (logical_grover.logical_test(..., serial=True)) with the
+# sparse simulator, e.g. for vectors with several solutions in each class
+# Returns the largest difference between the address probabilities of the two, for each input vector
+def verify_serial(vectors, mode='bucket_brigade', tol=1e-6, verbose=True):
+    from sparse_sim import sparse_run
+    errors = {}
+    for vector in vectors:
+        n = int(np.log2(len(vector)))
+        state, _ = sparse_run(serial_circuit(vector, mode))
+        probabilities = np.zeros(2 ** n)
+        for basis, amp in state.items():
+            probabilities[basis & (2 ** n - 1)] += abs(amp) ** 2
+        expected = logical_test([vector], serial=True)['probabilities'][0]
+        errors[tuple(vector)] = float(np.abs(probabilities - expected).max())
+        if verbose:
+            print("{}: largest difference {:.2e}{}".format(
+                vector, errors[tuple(vector)], '' if errors[tuple(vector)] < tol else '  <-- FAILED'))
+    return errors
+
+
+# Chooses between the standard Grover's circuit, exact mode and the serial divide-and-check engine: the one
+# with the fewest qubits among those reaching the solutions with probability at least min_success (which the
+# standard circuit fails e.g. when half of the addresses are solutions; the other two are exact), preferring
+# them in this order on a tie. As the serial engine needs one qubit more than exact mode, it is never chosen
+# for its qubit count
+# Returns the chosen strategy ('standard', 'exact' or 'serial') and a report of the projections, with the qubit
+# count of the standard circuit on the doubled search space for reference
+def choose_strategy(input_vector, mode='bucket_brigade', min_success=0.9):
+    from resources import count_qubits
+    marked = marked_addresses(input_vector)[0]
+    success = float(np.sum(logical_test([input_vector])['probabilities'][0][marked])) if marked.any() else 1.0
+    standard = count_qubits(input_vector, mode)[0]
+    exact = count_qubits(input_vector, mode, exact=True)[0]
+    serial = count_qubits(input_vector, mode, serial=True)[0]
+    report = {'standard_qubits': standard, 'exact_qubits': exact, 'serial_qubits': serial,
+              'standard_success': success,
+              'doubled_qubits': count_qubits(list(input_vector) + [0] * len(input_vector), mode)[0]}
+    candidates = [('standard', standard)] if success >= min_success else []
+    candidates += [('exact', exact), ('serial', serial)]
+    return min(candidates, key=lambda candidate: candidate[1])[0], report
+
+
+if __name__ == '__main__':
+    verify_serial([[1, 5, 7, 10, 2, 3, 9, 6], [2, 5, 5, 0, 1, 3, 4, 6], [2, 5, 5, 5, 1, 3, 4, 6]])
@@ -4,16 +4,18 @@ the maximum m allowed in the simulation from 2 to 4, with n = 2. Using these uti
 of the search space is no longer needed to be doubled for a length 4 input vector.
 '''
 
-from qiskit import QuantumCircuit, assemble, transpile, QuantumRegister, ClassicalRegister
-from qiskit.providers.aer import AerSimulator
-from qiskit.visualization import plot_histogram
-import matplotlib.pyplot as plt
+from qiskit import QuantumCircuit, transpile, QuantumRegister
+import rendering
+import instrument
+import ancilla
+import components
 import numpy as np
 
 
 # returns a two-qubit circuit that does the transformation |b>|a> -> 1/sqrt(2) * (|a>+|b>)|a>
 # in other words, it generates a equal superposition of two input states
 # |a> and |b> are guaranteed to be two different single-qubit Z basis states
+@instrument.traced('SUP')
 def superpose():
     a = QuantumRegister(1, name='a')
     b = QuantumRegister(1, name='b')
@@ -25,22 +27,23 @@ def superpose():
     u.ch(a[0], b[0])    # completes the transformation if a=0
     u.x(a[0])           # recovers the original a
 
-    u.draw()
-    plt.title("Circuit diagram of 1-bit superposition circuit; 'SUP' gate")
-    plt.savefig('.\circuit_diagrams\superpos_circ.svg')
+    rendering.request(u, "Circuit diagram of 1-bit superposition circuit; 'SUP' gate", 'superpos_circ.svg')
     return u
 
 
 # returns a 6-qubit circuit that does the transformation |j1>|j0>|b1>|b0>|a1>|a0> -> 1/sqrt(2) * |j1'>|j0'>(|a1a0>+|b1b0>)|a1a0>
 # |a1a0> and |b1b0> are guaranteed to be two different two-qubit Z basis states
-def superpose_2():
-    sup = superpose().to_gate(label='SUP')
-    csup = sup.control(1)
-    ccsup = sup.control(2)
+# With n_ancillas = 1, a clean ancilla (left in |0>) replaces the doubly-controlled SUP by a singly-controlled
+# one and the 3-controlled X by its v-chain decomposition (see ancilla.py)
+@instrument.traced('SUP_2')
+def superpose_2(n_ancillas=0):
+    csup = components.sup_gate(1)       # controlled once per process (see components.py)
+    ccsup = None if n_ancillas else components.sup_gate(2)
     a = QuantumRegister(2, name='a')    # stores state |a> = |a1a0>
     b = QuantumRegister(2, name='b')    # stores state |b> = |b1b0>
     j = QuantumRegister(2, name='j')    # judge qubit, reusing the previous two phase qubits
-    w = QuantumCircuit(a, b, j)
+    anc = QuantumRegister(n_ancillas, name='anc')
+    w = QuantumCircuit(a, b, j, anc) if n_ancillas else QuantumCircuit(a, b, j)
     w.h(j[0])  # change the state of j0 and j1 to |1>, as previously they are reused phase-kickback qubits in |->
     w.h(j[1])
     # w.save_statevector(label='psi_0')
@@ -68,37 +71,53 @@ def superpose_2():
     # w.save_statevector(label='psi_2')
 
     # Finally, deal with the case where neither C nor C' is true
-    w.append(ccsup, [j[0], j[1], a[0], b[0]])
+    if n_ancillas:      # j0 AND j1 is computed onto the ancilla, which controls SUP
+        w.ccx(j[0], j[1], anc[0])
+        w.append(csup, [anc[0], a[0], b[0]])
+        w.ccx(j[0], j[1], anc[0])
+    else:
+        w.append(ccsup, [j[0], j[1], a[0], b[0]])
     w.cx(b[0], a[0])
     w.x(a[0])
-    w.mcx([a[0], j[0], j[1]], b[1])
+    ancilla.mcx(w, [a[0], j[0], j[1]], b[1], anc)
     w.x(a[0])
     w.cx(b[0], a[0])
     # w.save_statevector(label='psi_3')
 
-    w.draw()
-    plt.title("Circuit diagram of 2-bit superposition circuit; 'SUP_2' gate")
-    plt.savefig('.\circuit_diagrams\superpos_2_circ.svg')
+    rendering.request(w, "Circuit diagram of 2-bit superposition circuit; 'SUP_2' gate", 'superpos_2_circ.svg')
     return w
 
 
 # Goes beyond the qubit limit for n = 2!
 # Returns the final QuantumCircuit to be used for simulating Task 1 with n = 2
-def improve(diffuser, qram, vc1, vc2, m):
+# diffuser is the DIF circuit, or the DIF gate of components.diffuser_gate
+# Any ancilla qubits of vc1, vc2 and diffuser (after their phase qubit) are wired to clean work qubits, and if
+# ancillas, SUP_2 borrows a clean qubit as well (see ancilla.py)
+@instrument.traced()
+def improve(diffuser, qram, vc1, vc2, m, ancillas=True):
     print("n = 2 detected.")
     print("Let's go beyond the limit.")
     b = QuantumRegister(2, name='b')        # the answer state
     a = QuantumRegister(2, name='a')        # the other address state
-    tau = QuantumRegister(4, name='tau')    # anciliary qubits for QRAM
-    mem = QuantumRegister(4 * m, name='m')    # memory qubits for QRAM
+    n_work = qram.num_qubits - 2 - m        # qubits of QRAM between the address and value registers
+    if n_work == 4 + 4 * m:                 # the Bucket-Brigade QRAM
+        tau = QuantumRegister(4, name='tau')    # anciliary qubits for QRAM
+        mem = QuantumRegister(4 * m, name='m')    # memory qubits for QRAM
+        work_registers = [tau, mem]
+    else:                                   # any other construction, e.g. QROM
+        work_registers = [QuantumRegister(n_work, name='w')] if n_work else []
     t = QuantumRegister(m, name='t')        # value qubits
     j = QuantumRegister(2, name='j')    # phase qubits, judge qubits later
-    qc = QuantumCircuit(b, a, tau, mem, t, j)
-    qram = qram.to_gate(label='QRAM')
-    vc1 = vc1.to_gate(label='VC_1')
-    vc2 = vc2.to_gate(label='VC_2')
-    dif = diffuser.to_gate(label='DIF')
-    sup_2 = superpose_2().to_gate(label='SUP_2')
+    qc = QuantumCircuit(b, a, *work_registers, t, j)
+    work = [q for register in work_registers for q in register]
+    kept = work[:len(ancilla.surviving_work(2, m, qram.num_qubits))]       # tau (or w), never the memory cells
+    clean = ancilla.CleanQubits(ancilla.idle_first(kept + list(t)))     # restored by every lookup
+    sup_2 = components.sup_2_gate(1 if ancillas and clean.available() else 0)
+    with instrument.stage('to_gate', gates='QRAM, VC_1, VC_2'):
+        qram = qram.to_gate(label=qram.name)
+        vc1 = vc1.to_gate(label='VC_1')
+        vc2 = vc2.to_gate(label='VC_2')
+        dif = diffuser.to_gate(label='DIF') if isinstance(diffuser, QuantumCircuit) else diffuser
 
     # Now all components are ready.
     # First, initialize two address states and two phase qubits
@@ -115,25 +134,25 @@ def improve(diffuser, qram, vc1, vc2, m):
 
 
     # Second, connect QRAM, VC_1, another QRAM (to restore t register), and DIF for VC_1
-    qc.append(qram, [a[i] for i in range(2)] + [tau[i] for i in range(4)] + [mem[i] for i in range(4*m)]
-                        + [t[i] for i in range(m)])
-    qc.append(vc1, [t[i] for i in range(m)] + [j[0]])
-    qc.append(qram, [a[i] for i in range(2)] + [tau[i] for i in range(4)] + [mem[i] for i in range(4*m)]
-                        + [t[i] for i in range(m)])
-    qc.append(dif, [a[0], a[1], j[0]])
+    qc.append(qram, [a[i] for i in range(2)] + work + [t[i] for i in range(m)])
+    clean.dirty(t)
+    qc.append(vc1, [t[i] for i in range(m)] + [j[0]] + clean.borrow(vc1.num_qubits - m - 1))
+    qc.append(qram, [a[i] for i in range(2)] + work + [t[i] for i in range(m)])
+    clean.restore(t)
+    qc.append(dif, [a[0], a[1], j[0]] + clean.borrow(dif.num_qubits - 3))
 
 
     # Third, connect QRAM, VC_2, another QRAM (to restore t register), and DIF for VC_2
-    qc.append(qram, [b[i] for i in range(2)] + [tau[i] for i in range(4)] + [mem[i] for i in range(4*m)]
-                        + [t[i] for i in range(m)])
-    qc.append(vc2, [t[i] for i in range(m)] + [j[1]])
-    qc.append(qram, [b[i] for i in range(2)] + [tau[i] for i in range(4)] + [mem[i] for i in range(4*m)]
-                        + [t[i] for i in range(m)])
-    qc.append(dif, [b[0], b[1], j[1]])
+    qc.append(qram, [b[i] for i in range(2)] + work + [t[i] for i in range(m)])
+    clean.dirty(t)
+    qc.append(vc2, [t[i] for i in range(m)] + [j[1]] + clean.borrow(vc2.num_qubits - m - 1))
+    qc.append(qram, [b[i] for i in range(2)] + work + [t[i] for i in range(m)])
+    clean.restore(t)
+    qc.append(dif, [b[0], b[1], j[1]] + clean.borrow(dif.num_qubits - 3))
 
 
     # Finally, connect SUP_2
-    qc.append(sup_2, [a[0], a[1], b[0], b[1], j[0], j[1]])
+    qc.append(sup_2, [a[0], a[1], b[0], b[1], j[0], j[1]] + clean.borrow(sup_2.num_qubits - 6))
 
 
     return qc
@@ -141,6 +160,7 @@ def improve(diffuser, qram, vc1, vc2, m):
 
 # Test finished. No bug has been detected.
 def dlc_test(a, b):
+    from qiskit.providers.aer import AerSimulator
     sim = AerSimulator(method='statevector', precision='single')
     sup_2 = superpose_2()
 
@@ -172,14 +192,47 @@ def dlc_test(a, b):
     # qc = prepare_circ
     # qc.save_statevector()
 
+    qc.save_statevector()
+
     qc = transpile(qc, sim)
     result = sim.run(qc, shots=8000).result()
-    state = result.data(0)['psi_3']
+    state = result.get_statevector()
     print(state[27], state[31])
 
 
+# Checks superpose and superpose_2 on every ordered pair (a, b) of distinct basis states in one pass: the
+# unitary of each circuit is computed once and applied to the stack of all the input states, with the j
+# qubits of superpose_2 in |-> (as in improve)
+# Returns a dictionary mapping (gate label, a, b) to the fidelity of the output with 1/sqrt(2) * (|a>+|b>)|a>
+# on the a and b registers (whatever the final state of the j qubits)
+def verify_superpose(tol=1e-6, verbose=True):
+    from qiskit.quantum_info import Operator
+    minus = np.array([1, -1]) / np.sqrt(2)
+    fidelities = {}
+    for label, circuit, bits in (('SUP', superpose(), 1), ('SUP_2', superpose_2(), 2)):
+        d = 2 ** bits
+        pairs = [(a, b) for a in range(d) for b in range(d) if a != b]
+        judge = np.ones(1)
+        for _ in range(circuit.num_qubits - 2 * bits):
+            judge = np.kron(judge, minus)
+        # basis state |j>|b>|a> has index j * d^2 + b * d + a
+        inputs = np.array([np.kron(judge, np.eye(d * d)[b * d + a]) for a, b in pairs])
+        targets = np.zeros((len(pairs), d * d))
+        for i, (a, b) in enumerate(pairs):
+            targets[i, a * d + a] = targets[i, b * d + a] = 1 / np.sqrt(2)
+
+        outputs = (inputs @ Operator(circuit).data.T).reshape(len(pairs), -1, d * d)
+        overlaps = np.einsum('pjk,pk->pj', outputs, targets)
+        for (a, b), fidelity in zip(pairs, np.sum(np.abs(overlaps) ** 2, axis=1)):
+            fidelities[(label, a, b)] = float(fidelity)
+            if verbose:
+                print("{}: a = {}, b = {}, fidelity {:.6f}{}".format(
+                    label, a, b, fidelity, '' if fidelity > 1 - tol else '  <-- FAILED'))
+    return fidelities
+
+
 if __name__ == '__main__':
-    dlc_test(3, 2)
+    verify_superpose()
 
 
 
@@ -0,0 +1,193 @@
+'''
+This file implements the instrumentation layer of the circuit construction and simulation. The stages of
+main, oracle, diffuser and from2to4 (building QRAM/VC/DIF/SUP_2, to_gate and control, transpile, sim.run,
+the extraction of the final state) are wrapped with stage() or the traced decorator, which do nothing unless
+instrumentation has been enabled, so they cost a single flag check on the hot path by default.
+
+Once enabled, every stage emits one structured event (a dictionary) when it finishes, with its wall time, the
+peak RSS of the process, the qubit/gate/depth counts of the circuit it produced and Aer's own metadata
+(time_taken, memory used, ...) when available. Events are sent to pluggable sinks: any callable taking the
+event, e.g. log_sink() (the logging module), JSONLSink (one JSON line per event) or an in-process callback.
+
+Usage:
+    import instrument
+    instrument.enable(instrument.log_sink(), instrument.JSONLSink('trace.jsonl'))
+    Grovers_test([1, 5, 7, 10])
+'''
+
+import functools
+import json
+import logging
+import threading
+import time
+
+
+_enabled = False
+_sinks = []
+_local = threading.local()      # the stack of the running stages of each thread
+
+
+# Enables instrumentation, sending the events to the given sinks (in addition to the ones already added)
+def enable(*sinks):
+    global _enabled
+    _sinks.extend(sinks)
+    _enabled = True
+
+
+# Disables instrumentation and removes the sinks
+def disable():
+    global _enabled
+    _enabled = False
+    for sink in _sinks:
+        if hasattr(sink, 'close'):
+            sink.close()
+    del _sinks[:]
+
+
+def is_enabled():
+    return _enabled
+
+
+# Returns a sink writing each event to the given logger (default: the 'instrument' logger)
+def log_sink(logger=None, level=logging.INFO):
+    logger = logger or logging.getLogger('instrument')
+
+    def sink(event):
+        logger.log(level, "%s: %.4fs %s", event['stage'], event['wall_time'],
+                   {key: value for key, value in event.items() if key not in ('stage', 'wall_time')})
+    return sink
+
+
+# A sink appending each event as one JSON line to a file
+class JSONLSink:
+    def __init__(self, path):
+        self.file = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        with self.lock:
+            self.file.write(json.dumps(event, default=str) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# Returns the peak resident set size of the process so far, in kB (None if unavailable)
+def peak_rss_kb():
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:     # not available on Windows
+        return None
+
+
+# Returns the qubit count, gate count and depth of a circuit (the gates being counted at the top level)
+def circuit_counts(circuit):
+    return {'num_qubits': circuit.num_qubits, 'size': circuit.size(), 'depth': circuit.depth()}
+
+
+# Returns the metadata reported by Aer for a result: the simulation time and the memory it used
+def aer_metadata(result):
+    metadata = {'time_taken': getattr(result, 'time_taken', None)}
+    metadata.update(getattr(result, 'metadata', None) or {})
+    experiments = getattr(result, 'results', None) or []
+    if experiments:
+        experiment = experiments[0]
+        metadata['experiment_time_taken'] = getattr(experiment, 'time_taken', None)
+        metadata.update({'experiment_' + key: value
+                         for key, value in (getattr(experiment, 'metadata', None) or {}).items()})
+    return metadata
+
+
+def emit(event):
+    for sink in list(_sinks):
+        sink(event)
+
+
+class _Stage:
+    def __init__(self, name, fields):
+        self.event = dict(fields, stage=name)
+
+    # Records the qubit/gate/depth counts of a circuit produced by the stage
+    def circuit(self, circuit, prefix=''):
+        self.event.update({prefix + key: value for key, value in circuit_counts(circuit).items()})
+
+    # Records the metadata of an Aer result
+    def aer(self, result):
+        self.event['aer'] = aer_metadata(result)
+
+    # Records any other field
+    def record(self, **fields):
+        self.event.update(fields)
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if stack:
+            self.event['parent'] = stack[-1].event['stage']
+        stack.append(self)
+        self.event['peak_rss_kb_before'] = peak_rss_kb()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.event['wall_time'] = time.perf_counter() - self.start
+        self.event['peak_rss_kb'] = peak_rss_kb()
+        if exc_type is not None:
+            self.event['error'] = repr(exc)
+        _local.stack.pop()
+        emit(self.event)
+        return False
+
+
+class _NullStage:
+    def circuit(self, circuit, prefix=''):
+        pass
+
+    def aer(self, result):
+        pass
+
+    def record(self, **fields):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+# Returns a context manager timing the stage name, with the given fields added to its event
+# The object it returns can record the circuit and the Aer result of the stage:
+#     with instrument.stage('transpile') as s:
+#         circ = transpile(circ, sim)
+#         s.circuit(circ)
+def stage(name, **fields):
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, fields)
+
+
+# Decorator timing every call of a function as the stage name (default: the name of the function),
+# recording the counts of the circuit it returns (or of the first circuit of the tuple it returns)
+def traced(name=None):
+    def decorator(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Stage(stage_name, {}) as s:
+                output = function(*args, **kwargs)
+                circuit = output[0] if isinstance(output, tuple) else output
+                if hasattr(circuit, 'num_qubits') and hasattr(circuit, 'depth'):
+                    s.circuit(circuit)
+            return output
+        return wrapper
+    return decorator
@@ -0,0 +1,166 @@
+'''
+This file implements a logical-level model of the Grover's circuit used in Task 1, which only simulates
+the n address qubits. The QRAM -> VC -> QRAM sequence of the oracle restores the tau/m/t registers, so its
+net effect on the address register is a diagonal +-1 phase, which can be compiled classically from the input
+vector and the type of VC. Likewise, DIF is the reflection 2|s><s| - I about the equal superposition state,
+which is just "2 * mean - amplitude" on the 2^n amplitudes.
+
+Everything is vectorized with NumPy, and many input vectors (of the same length) can be stacked in a 2-D
+array to be simulated at once. For small sizes, logical_verify checks the model against the full circuit.
+'''
+
+import numpy as np
+
+
+# Returns the length m of the bitstrings of each input vector, determined by its largest value
+# (same as in oracle_circuit); vectors is a 2-D array, one input vector per row
+def value_lengths(vectors):
+    return np.floor(np.log2(vectors.max(axis=1))).astype(int) + 1
+
+
+# Returns a boolean array marking the addresses that VC_{vc_type} adds a pi phase to
+#   - type 0: alternating bitstrings (both solutions)
+#   - type 1: alternating bitstrings starting with 0 (i.e. |0101010...>, reading from MSB)
+#   - type 2: alternating bitstrings starting with 1 (i.e. |101010101...>)
+def marked_addresses(vectors, vc_type=0):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.int64))
+    m = value_lengths(vectors)[:, None]
+    low_bits = (1 << (m - 1)) - 1
+    # VC first replaces bit i with bit i XOR bit i+1, the bitstring is alternating iff all of them are 1
+    marked = ((vectors ^ (vectors >> 1)) & low_bits) == low_bits
+    msb = (vectors >> (m - 1)) & 1
+    if vc_type == 1:
+        marked &= msb == 0
+    elif vc_type == 2:
+        marked &= msb == 1
+    return marked
+
+
+# Compiles the input vectors and the type of VC into the diagonal phase of the oracle on the address register
+def phase_vector(vectors, vc_type=0):
+    return np.where(marked_addresses(vectors, vc_type), -1.0, 1.0)
+
+
+# The reflection about |s> applied by DIF, on each row of the amplitudes
+def diffuse(amplitudes):
+    return 2 * amplitudes.mean(axis=1, keepdims=True) - amplitudes
+
+
+# Same number of iterations as in Grovers_circuit, i.e. assuming M = 2 solutions out of N = 2^n
+def num_iterations(n):
+    theta = np.arcsin(np.sqrt(2 / 2 ** n))
+    return round((np.pi / 2 / theta - 1) / 2)
+
+
+# Runs Grover's algorithm on the address register only
+# Returns the final amplitudes (one row per input vector) and the success probability after each iteration,
+# as an array of shape (number of vectors, iterations + 1), whose column 0 is before the first iteration
+def logical_grover(vectors, vc_type=0, iterations=None):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.int64))
+    N = vectors.shape[1]
+    n = int(np.log2(N))
+    if iterations is None:
+        iterations = num_iterations(n)
+    phases = phase_vector(vectors, vc_type)
+    marked = phases < 0
+
+    amplitudes = np.full(vectors.shape, 1 / np.sqrt(N))     # the state |s>
+    success = np.empty((vectors.shape[0], iterations + 1))
+    success[:, 0] = np.sum(amplitudes ** 2 * marked, axis=1)
+    for k in range(iterations):
+        amplitudes = diffuse(phases * amplitudes)           # ORACLE followed by DIF
+        success[:, k + 1] = np.sum(amplitudes ** 2 * marked, axis=1)
+    return amplitudes, success
+
+
+# Reproduces what Grovers_circuit does for the given input vectors
+# Returns a dictionary with the final address probabilities and the success probabilities per iteration
+#   - for n = 2, the two branches of from2to4.improve (VC_1 and VC_2, one iteration each) are reported as
+#     'branch_1' and 'branch_2', and the final probabilities are the ones after SUP_2, which equally
+#     superposes the two (distinct) answers
+#   - otherwise, the standard Grover's algorithm with VC_0 is used
+# If serial, the serial divide-and-check engine of divide_check.py is modelled instead (see logical_serial)
+def logical_test(vectors, serial=False):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.int64))
+    n = int(np.log2(vectors.shape[1]))
+    if serial:
+        return {'probabilities': np.array([logical_serial(vector) for vector in vectors])}
+    if n == 1:
+        return {'probabilities': np.full(vectors.shape, 0.5)}
+    if n == 2:
+        amp_1, success_1 = logical_grover(vectors, vc_type=1, iterations=1)
+        amp_2, success_2 = logical_grover(vectors, vc_type=2, iterations=1)
+        return {'probabilities': (amp_1 ** 2 + amp_2 ** 2) / 2,
+                'branch_1': {'probabilities': amp_1 ** 2, 'success': success_1},
+                'branch_2': {'probabilities': amp_2 ** 2, 'success': success_2}}
+    amplitudes, success = logical_grover(vectors)
+    return {'probabilities': amplitudes ** 2, 'success': success}
+
+
+# Runs the serial divide-and-check engine of divide_check.py on the address register and the class flag f:
+# the amplitudes are indexed by f * 2^n + address, the solutions of type 1 being marked for f = 0 and the ones
+# of type 2 for f = 1 (only the class with solutions is searched, without flag, if the other one has none)
+# The schedule of main.exact_schedule is followed, the last oracle adding e^(i*oracle_phase) and the last
+# diffuser applying (1 - e^(i*diffuser_phase))|s><s| - I
+# Returns the final address probabilities
+def logical_serial(input_vector):
+    from main import exact_schedule
+    vector = np.atleast_2d(np.asarray(input_vector, dtype=np.int64))
+    N = vector.shape[1]
+    classes = [marked_addresses(vector, vc_type)[0] for vc_type in (1, 2)]
+    classes = [marked for marked in classes if marked.any()] or [np.zeros(N, dtype=bool)]
+    marked = np.concatenate(classes)
+    n_searched = int(np.log2(marked.size))
+    k, oracle_phase, diffuser_phase = exact_schedule(n_searched, int(np.sum(marked)))
+
+    amplitudes = np.full(marked.size, 1 / np.sqrt(marked.size), dtype=complex)
+    for _ in range(k):
+        amplitudes = diffuse(np.where(marked, -amplitudes, amplitudes)[None, :])[0]      # ORACLE followed by DIF
+    if oracle_phase is not None:
+        amplitudes = np.where(marked, np.exp(1j * oracle_phase) * amplitudes, amplitudes)
+        amplitudes = (1 - np.exp(1j * diffuser_phase)) * amplitudes.mean() - amplitudes
+    return np.sum(np.abs(amplitudes.reshape(-1, N)) ** 2, axis=0)
+
+
+# Returns the marginal probabilities of the given qubits (qubits[0] as the least significant bit) of a sparse state
+def _marginal(state, qubits):
+    probs = np.zeros(2 ** len(qubits))
+    for basis, amp in state.items():
+        index = 0
+        for i, q in enumerate(qubits):
+            index |= ((basis >> q) & 1) << i
+        probs[index] += abs(amp) ** 2
+    return probs
+
+
+# Checks the logical model against the full circuit from Grovers_circuit, simulated by the sparse simulator
+# Returns the largest difference between the address probabilities of the two
+def logical_verify(input_vector, tol=1e-6):
+    from main import Grovers_circuit
+    from sparse_sim import sparse_run
+
+    circ, n = Grovers_circuit(input_vector)
+    expected = logical_test([input_vector])
+    if n == 2:
+        # compare the two branches just before SUP_2, where register a (qubit 2~3) holds the answer of VC_1
+        # and register b (qubit 0~1) holds the answer of VC_2
+        del circ.data[-1]
+        state, _ = sparse_run(circ)
+        errors = [np.abs(_marginal(state, [2, 3]) - expected['branch_1']['probabilities'][0]).max(),
+                  np.abs(_marginal(state, [0, 1]) - expected['branch_2']['probabilities'][0]).max()]
+        error = max(errors)
+    else:
+        state, _ = sparse_run(circ)
+        error = np.abs(_marginal(state, list(range(n))) - expected['probabilities'][0]).max()
+
+    if error > tol:
+        print("Mismatch for input_vector {}: the largest difference in probability is {}".format(input_vector, error))
+    else:
+        print("The logical model agrees with the full circuit for input_vector {}.".format(input_vector))
+    return error
+
+
+if __name__ == '__main__':
+    input_vector = [1, 5, 7, 10]
+    print(logical_test([input_vector]))
+    logical_verify(input_vector)
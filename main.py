@@ -1,19 +1,101 @@
 from qiskit.circuit.classicalregister import ClassicalRegister
 from qiskit.circuit.quantumcircuit import QuantumCircuit
-from oracle import oracle_circuit
-from diffuser import diffuser_circuit
+from oracle import oracle_circuit, phase_oracle_circuit
+from diffuser import phase_diffuser_circuit
+from logical_grover import marked_addresses
+from divide_check import serial_circuit, choose_strategy
 import from2to4 as dlc
-from qiskit.providers.aer import AerSimulator
 from qiskit import transpile, ClassicalRegister
-from qiskit.quantum_info import partial_trace
-import matplotlib.pyplot as plt
+from sparse_sim import sparse_run, sparse_counts, address_state
+from reduced_state import reduced_address_state, sparse_reduced_state
+from circuit_cache import default_cache, circuit_key
+from resources import estimate_resources, plan_simulation
+from optimize import optimize_circuit
+import rendering
+import instrument
+import ancilla
+import components
 import numpy as np
+import sys
+
+
+# Returns the schedule of the exact amplitude amplification for M solutions out of N = 2^n: k standard
+# iterations, then one last iteration whose oracle adds e^(i*oracle_phase) to the solutions and whose diffuser
+# applies (1 - e^(i*diffuser_phase))|s><s| - I, chosen so that the success probability is exactly 1
+# Returns (k, oracle_phase, diffuser_phase), with phases None if no last iteration is needed
+def exact_schedule(n, M):
+    N = 2 ** n
+    if M == 0 or M == N:        # nothing to amplify
+        return 0, None, None
+    theta = np.arcsin(np.sqrt(M / N))
+    k = max(0, int(np.ceil((np.pi / 2 / theta - 1) / 2)) - 1)
+    alpha = (2 * k + 1) * theta     # the angle between the state and |w'> after k standard iterations
+    if abs(np.cos(alpha)) < 1e-12:
+        return k, None, None
+
+    # In the plane of |w> (solutions) and |w'>, the amplitude left on |w'> after the last iteration vanishes iff
+    # e^(i*oracle_phase) = v(diffuser_phase) below; search the diffuser phase for which |v| = 1
+    def v(phase):
+        return ((np.cos(alpha) / ((1 - np.exp(1j * phase)) * np.cos(theta)) - np.cos(theta) * np.cos(alpha))
+                / (np.sin(theta) * np.sin(alpha)))
+
+    low, high = 1e-9, np.pi     # |v| - 1 is positive at low and not positive at high
+    if abs(abs(v(high)) - 1) > 1e-12:
+        for _ in range(100):
+            middle = (low + high) / 2
+            if abs(v(middle)) > 1:
+                low = middle
+            else:
+                high = middle
+    return k, float(np.angle(v(high))), float(high)
+
+
+# Returns the circuit of the exact amplitude amplification on the lookup register (address, work and value
+# qubits), which reaches the solutions with probability 1 for any n, using the actual number of solutions
+@instrument.traced()
+def exact_circuit(input_vector, mode='bucket_brigade'):
+    n = int(np.log2(len(input_vector)))
+    M = int(np.sum(marked_addresses(input_vector)))
+    k, oracle_phase, diffuser_phase = exact_schedule(n, M)
+    oracle = phase_oracle_circuit(input_vector, np.pi, mode)
+    n_qubits = oracle.num_qubits
+    overall_circ = QuantumCircuit(n_qubits)
+    for i in range(n):
+        overall_circ.h(i)
+
+    oracle = oracle.to_gate(label='ORACLE')
+    dif = phase_diffuser_circuit(n, np.pi).to_gate(label='DIF')
+    for _ in range(k):
+        overall_circ.append(oracle, list(range(n_qubits)))
+        overall_circ.append(dif, list(range(n)))
+    if oracle_phase is not None:        # the last, phase-matched iteration
+        overall_circ.append(phase_oracle_circuit(input_vector, oracle_phase, mode).to_gate(label='ORACLE_phase'),
+                            list(range(n_qubits)))
+        overall_circ.append(phase_diffuser_circuit(n, diffuser_phase).to_gate(label='DIF_phase'), list(range(n)))
+    return overall_circ
 
 
 # The main function that returns a QuantumCircuit that solves Task 1 for arbitrary m and n
-def Grovers_circuit(input_vector):
-    qc, vc1, vc2, m, n = oracle_circuit(input_vector)
-    diffuser = diffuser_circuit(n)
+# mode selects the construction of the QRAM in the oracle, either 'bucket_brigade', 'qrom' or the
+# depth-optimized 'parallel' (see oracle.py)
+# If exact, the exact amplitude amplification of exact_circuit is used for every n, instead of the M = 2
+# iteration count (and the from2to4.improve circuit for n = 2)
+# If ancillas, the MCX gates of VC, DIF and SUP_2 borrow the qubits known to be clean when they run
+# (see ancilla.py)
+# If serial, both classes of solutions are searched at once with a class flag qubit, for any n
+# (see divide_check.py)
+@instrument.traced()
+def Grovers_circuit(input_vector, mode='bucket_brigade', exact=False, ancillas=True, serial=False):
+    if serial:
+        return serial_circuit(input_vector, mode), int(np.log2(len(input_vector)))
+    if exact:
+        overall_circ = exact_circuit(input_vector, mode)
+        n = int(np.log2(len(input_vector)))
+        rendering.request(overall_circ, "Exact amplitude amplification circuit for input_vector "
+                          + str(input_vector), 'overall.svg')
+        return overall_circ, n
+
+    qc, vc1, vc2, m, n = oracle_circuit(input_vector, mode, ancillas)
     overall_circ = None
 
     if n == 1:      # the trivial case, directly returns the |+> state
@@ -22,13 +104,19 @@ def Grovers_circuit(input_vector):
 
     elif n == 2:
         # where we go beyond the qubit limit using from2to4.py
-        overall_circ = dlc.improve(diffuser, qc, vc1, vc2, m)
+        overall_circ = dlc.improve(components.diffuser_gate(n), qc, vc1, vc2, m, ancillas)
     else:
         # where we just apply the normal Grover's algorithm      
         n_qubits = qc.num_qubits        # The total number of qubits of the oracle
         overall_circ = QuantumCircuit(n_qubits)
-        oracle = qc.to_gate(label='ORACLE')
-        dif = diffuser.to_gate(label='DIF')        
+        # the work and t registers are restored by the oracle, so they are clean while DIF runs (borrowed from
+        # the t register down, and only the work qubits optimize.py keeps, see ancilla.idle_first)
+        borrowable = list(ancilla.surviving_work(n, m, n_qubits - 1)) + list(range(n_qubits - 1 - m, n_qubits - 1))
+        clean = ancilla.CleanQubits(ancilla.idle_first(borrowable) if ancillas else [])
+        dif_ancillas = clean.borrow(ancilla.ancillas_needed(n, clean.available()))
+        dif = components.diffuser_gate(n, len(dif_ancillas))       # synthesized once per process
+        with instrument.stage('to_gate', gates='ORACLE'):
+            oracle = qc.to_gate(label='ORACLE')
         theta = np.arcsin(np.sqrt(2 / 2 ** n))     # the angle between |s> and |w'>, as M=2 and N=2^n
         t = round((np.pi / 2 / theta - 1) / 2)      # number of iterations needed
         # First, initialize the address state to |s>, and phase qubit to |->
@@ -39,49 +127,221 @@ def Grovers_circuit(input_vector):
 
         for _ in range(t):
             overall_circ.append(oracle, list(range(n_qubits)))
-            overall_circ.append(dif, list(range(n)) + [n_qubits - 1])    # Connects DIF to oracle
+            overall_circ.append(dif, list(range(n)) + [n_qubits - 1] + dif_ancillas)    # Connects DIF to oracle
         
-    overall_circ.draw()
-    plt.title("Overall circuit for input_vector " + str(input_vector) + " , with n = {}, m = {}".format(n, m))
-    plt.savefig(".\circuit_diagrams\overall.svg")
+    rendering.request(overall_circ, "Overall circuit for input_vector " + str(input_vector)
+                      + " , with n = {}, m = {}".format(n, m), 'overall.svg')
         
   
     return overall_circ, n
 
 
+# Returns the circuit used to simulate input_vector and n, the number of address qubits, going through the
+# two-tier circuit cache (pass cache=None to always rebuild)
+# If sim is given, the circuit is transpiled for it, without any measurement or save instruction;
+# target identifies the simulator configuration in the cache key
+# mode is passed to Grovers_circuit
+# If optimize, the constant-propagation and cancellation pass in optimize.py runs before transpile, which
+# removes the m register of QRAM altogether (the address qubits stay the first n qubits)
+# exact and serial are passed to Grovers_circuit (serial='auto' is resolved by resolve_strategy)
+def prepare_circuit(input_vector, sim=None, target='sparse', cache=default_cache, mode='bucket_brigade',
+                    optimize=True, exact=False, serial=False):
+    n = int(np.log2(len(input_vector)))
+    exact, serial = resolve_strategy(input_vector, mode, exact, serial)
+
+    def build():
+        circ, _ = Grovers_circuit(input_vector, mode, exact, serial=serial)
+        if optimize:
+            with instrument.stage('optimize') as s:
+                circ, _, _ = optimize_circuit(circ, keep=range(n))
+                s.circuit(circ)
+        if sim is not None:
+            with instrument.stage('transpile') as s:
+                circ = transpile(circ, sim)
+                s.circuit(circ)
+        return circ
+
+    if cache is None:
+        return build(), n
+    return cache.get(circuit_key(input_vector, target, mode=mode, optimize=optimize, exact=exact,
+                                 serial=serial, fused=components.fused()), build), n
+
+
+# Returns (exact, serial), resolving serial='auto' into the strategy divide_check.choose_strategy chooses:
+# the standard circuit, exact mode or the serial engine
+def resolve_strategy(input_vector, mode='bucket_brigade', exact=False, serial=False):
+    if serial != 'auto':
+        return exact, serial
+    strategy, _ = choose_strategy(input_vector, mode)
+    return exact or strategy == 'exact', strategy == 'serial'
+
+
+# Runs the circuit on the Aer simulator, as the instrumented stage 'sim.run'
+def _run(sim, circuit, **options):
+    with instrument.stage('sim.run', num_qubits=circuit.num_qubits) as s:
+        result = sim.run(circuit, **options).result()
+        s.aer(result)
+    return result
+
+
 # The test function
 # If return_state, return the final state; otherwise, only measure the final state. Default to be False.
 # n_shots is the total number of experiments to be run if measurement is used
-def Grovers_test(input_vector, return_state=False, n_shots=8000):
-    Grovers_circ, n = Grovers_circuit(input_vector)
-    print("Circuit generation complete.")
-    num_q = Grovers_circ.num_qubits     # the total number of qubits of the overall circuit
-    sim = AerSimulator(method='statevector', precision='single')
-    if return_state:        # to directly return the final state
-        Grovers_circ.save_statevector()
-        qc = transpile(Grovers_circ, sim)
-        result = sim.run(qc).result()
-        state = result.get_statevector(decimals=3)
-        reduced_dm = partial_trace(state, list(range(n, num_q)))    # only focus on the state of n address qubits
-        wanted_state = np.sqrt(np.diagonal(reduced_dm))     # convert density matrix into statevector
+# method is either 'statevector' (the dense AerSimulator), 'sparse' (the sparse simulator in sparse_sim.py,
+# which only tracks nonzero amplitudes and therefore works for much larger m and n), or 'auto' to let
+# resources.plan_simulation choose the cheapest one that fits in budget bytes (default: the available memory)
+# 'matrix_product_state' runs the MPS simulator through mps.py (only the address probabilities are returned)
+# If nothing fits, resources.InsufficientMemoryError is raised before allocating anything
+# Built and transpiled circuits are reused through cache (see circuit_cache.py), pass cache=None to disable it
+# mode selects the construction of the QRAM, 'qrom' needs far fewer qubits (see oracle.py)
+# optimize runs the pass in optimize.py before simulating, see prepare_circuit
+# state_mode selects how the final address state is extracted if return_state:
+#     'amplitudes': the amplitudes with their phases, streamed from the statevector (see reduced_state.py)
+#     'probabilities': only the magnitudes, saved inside Aer with save_probabilities (the statevector never
+#                      leaves the simulator)
+#     'partial_trace': the original square root of the diagonal of the reduced density matrix, which copies
+#                      the whole statevector
+# If exact, the exact amplitude amplification is simulated (see exact_circuit)
+# If serial, the serial divide-and-check engine is simulated (see divide_check.py); 'auto' simulates whichever
+# of the standard circuit, exact mode and the serial engine divide_check.choose_strategy prefers
+# Returns the final address state if return_state, otherwise the measured counts
+def Grovers_test(input_vector, return_state=False, n_shots=8000, method='auto', cache=default_cache,
+                 mode='bucket_brigade', budget=None, optimize=True, state_mode='amplitudes', exact=False,
+                 serial=False):
+    exact, serial = resolve_strategy(input_vector, mode, exact, serial)
+    rendering.take_requested('overall.svg')         # forgets the diagrams of earlier calls
+    report = estimate_resources(input_vector, mode, count_gates=False, optimize=optimize, exact=exact,
+                                serial=serial)
+    plan = plan_simulation(report, budget, method, return_state and state_mode == 'partial_trace')
+    print("Simulating with {} (projected memory: {:.3f} GB).".format(plan['name'], plan['memory'] / 1024 ** 3))
+    if plan['engine'] == 'mps':       # with the layout pass and the statevector cross-check of mps.py
+        from mps import mps_test, format_mps_report
+        mps_report = mps_test(input_vector, n_shots=None if return_state else n_shots, cache=cache, mode=mode,
+                              optimize=optimize, exact=exact, serial=serial, budget=budget)
+    if plan['engine'] == 'sparse':
+        Grovers_circ, n = prepare_circuit(input_vector, cache=cache, mode=mode, optimize=optimize, exact=exact,
+                                          serial=serial)
+        print("Circuit generation complete.")
+        with instrument.stage('sparse_run', num_qubits=Grovers_circ.num_qubits) as s:
+            state, _ = sparse_run(Grovers_circ)
+            s.record(nonzero_amplitudes=len(state))
+        if return_state and state_mode == 'amplitudes':
+            with instrument.stage('reduced_state'):
+                reduced = sparse_reduced_state(state, n)
+            wanted_state = np.round(reduced['amplitudes'], 3)
+            print("Fidelity of the reduced address state: {:.6f}".format(reduced['fidelity']))
+        elif return_state:
+            wanted_state = address_state(state, n)
+        else:
+            counts = sparse_counts(state, {i: i for i in range(n)}, n, n_shots)
+    elif plan['engine'] == 'mps':
+        print(format_mps_report(mps_report))
+        n = int(np.log2(len(input_vector)))
+        if return_state:
+            wanted_state = np.round(np.sqrt(mps_report['probabilities']), 3)
+        else:
+            counts = mps_report['counts']
+    else:
+        from qiskit.providers.aer import AerSimulator       # only loaded when Aer actually runs
+        sim = AerSimulator(method=plan['method'], precision=plan['precision'])
+        Grovers_circ, n = prepare_circuit(input_vector, sim, ('aer', plan['method'], plan['precision']), cache, mode,
+                                          optimize, exact, serial)
+        print("Circuit generation complete.")
+        qc = Grovers_circ.copy()        # the cached circuit is shared, so add the final instructions to a copy
+        num_q = qc.num_qubits     # the total number of qubits of the overall circuit
+        if return_state and state_mode == 'amplitudes':
+            qc.save_statevector()
+            state = np.asarray(_run(sim, qc).data(0)['statevector'])     # no rounded copy
+            with instrument.stage('reduced_state'):
+                reduced = reduced_address_state(state, n)
+            del state
+            wanted_state = np.round(reduced['amplitudes'], 3)
+            print("Fidelity of the reduced address state: {:.6f}".format(reduced['fidelity']))
+        elif return_state and state_mode == 'probabilities':
+            qc.save_probabilities(list(range(n)))       # marginalized inside Aer
+            probabilities = np.asarray(_run(sim, qc).data(0)['probabilities'])
+            wanted_state = np.round(np.sqrt(probabilities), 3)
+        elif return_state:        # to directly return the final state
+            qc.save_statevector()
+            result = _run(sim, qc)
+            state = result.get_statevector(decimals=3)
+            from qiskit.quantum_info import partial_trace
+            with instrument.stage('partial_trace'):
+                reduced_dm = partial_trace(state, list(range(n, num_q)))    # only focus on the state of n address qubits
+            wanted_state = np.sqrt(np.diagonal(reduced_dm))     # convert density matrix into statevector
+        else:                   # to only measure the final state
+            meas = ClassicalRegister(n)
+            qc.add_register(meas)
+            for i in range(n):
+                qc.measure(i, meas[i])        # measure the address qubits
+            result = _run(sim, qc, shots=n_shots)
+            counts = result.get_counts()
+
+    rendered = rendering.take_requested('overall.svg')     # not on a cache hit
+    if return_state:
         print("The final statevector is: " + str(wanted_state))
-        print("The circuit diagram file is saved as .\circuit_diagrams\overall.svg")
-    else:                   # to only measure the final state
-        meas = ClassicalRegister(n)
-        Grovers_circ.add_register(meas)
-        for i in range(n):
-            Grovers_circ.measure(i, meas[i])        # measure the address qubits
-        qc = transpile(Grovers_circ, sim)
-        result = sim.run(qc, shots=n_shots).result()
-        counts = result.get_counts()
-        print("Out of {} experiments, ".format(n_shots), end="")
-        for index in counts.keys():
-            print("{} was measured {} times, ".format(index, counts[index]), end="")
-        print("while also saving the circuit diagram file as .\circuit_diagrams\overall.svg.")
+        if rendered:
+            print("The circuit diagram file is saved as circuit_diagrams/overall.svg")
+        return wanted_state
+    print("Out of {} experiments, ".format(n_shots), end="")
+    for index in counts.keys():
+        print("{} was measured {} times, ".format(index, counts[index]), end="")
+    if rendered:
+        print("while also saving the circuit diagram file as circuit_diagrams/overall.svg.")
+    else:
+        print()
+    return counts
+
+
+# The command-line entry point: solves Task 1 for the input vector given as arguments
+# (python main.py 1 5 7 10 [--state] [--shots 8000] [--method auto] ...), or runs the worker of worker.py
+# with --worker. Nothing is plotted unless --diagrams is given
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Solve Task 1 for an input vector.")
+    parser.add_argument('input_vector', type=int, nargs='*', help="e.g. 1 5 7 10")
+    parser.add_argument('--state', action='store_true', help="return the final state instead of counts")
+    parser.add_argument('--shots', type=int, default=8000)
+    parser.add_argument('--method', default='auto',
+                        choices=['auto', 'statevector', 'sparse', 'matrix_product_state'])
+    parser.add_argument('--mode', default='bucket_brigade', choices=['bucket_brigade', 'qrom', 'parallel'])
+    parser.add_argument('--exact', action='store_true', help="exact amplitude amplification")
+    parser.add_argument('--serial', nargs='?', const=True, default=False, choices=[True, 'auto'],
+                        help="serial divide-and-check engine ('--serial auto': the standard circuit, exact mode or "
+                             "the serial engine, whichever choose_strategy prefers)")
+    parser.add_argument('--no-optimize', action='store_true', help="skip the pass in optimize.py")
+    parser.add_argument('--adaptive', action='store_true',
+                        help="sample in batches until the solutions are identified (--shots is the maximum)")
+    parser.add_argument('--confidence', type=float, default=0.99, help="confidence of the adaptive mode")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first batch of the adaptive mode")
+    parser.add_argument('--diagrams', action='store_true', help="render the circuit diagrams")
+    parser.add_argument('--worker', action='store_true', help="answer solve requests on stdin or a socket")
+    parser.add_argument('--socket', default=None, help="Unix socket path of the worker")
+    parser.add_argument('--port', type=int, default=None, help="localhost port of the worker")
+    args = parser.parse_args(argv)
+
+    if args.diagrams:
+        rendering.enable(background=True)      # circuit diagrams are only rendered on request
+    if args.worker:
+        import worker
+        warm = [args.input_vector] if args.input_vector else []
+        worker.serve(args.socket, args.port, warm)
+        return 0
+    if not args.input_vector:
+        parser.error("an input vector is required, e.g. python main.py 1 5 7 10")
+    if args.adaptive:
+        from adaptive import adaptive_test
+        result = adaptive_test(args.input_vector, args.confidence, max_shots=args.shots, seed=args.seed,
+                               method=args.method, mode=args.mode, optimize=not args.no_optimize,
+                               exact=args.exact, serial=args.serial)
+        print("Counts: {}".format(result['counts']))
+        rendering.wait()
+        return 0
+    Grovers_test(args.input_vector, return_state=args.state, n_shots=args.shots, method=args.method,
+                 mode=args.mode, optimize=not args.no_optimize, exact=args.exact, serial=args.serial)
+    rendering.wait()
+    return 0
 
 
 if __name__ == '__main__':
-    input_vector = [1, 5, 7, 10]
-    Grovers_test(input_vector)
-    # Optional return_state variable (default to be False) and n_shots variable (default to be 8000)
-    # can also be entered in the Grovers_test function to manually adjust the format of the output
+    sys.exit(main())
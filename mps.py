@@ -0,0 +1,233 @@
+'''
+This file implements a supported matrix_product_state (MPS) mode, for circuits far beyond the 30 qubits of the
+statevector simulator. The MPS simulator keeps the qubits in a linear chain and applies a gate on distant
+qubits by swapping them next to each other, so its cost (and, once the bond dimension is truncated, its
+accuracy) depends on how far apart the interacting qubits are. Grovers_circuit lays out its qubits register by
+register (a, tau, m, t, phase), which puts every memory cell m_k far from both its tau_k and the t register.
+
+Before simulating, the qubits are therefore relabelled along a chain that keeps the interacting ones close:
+    - 'rcm': the reverse Cuthill-McKee ordering of the interaction graph of the circuit (any circuit);
+    - 'qram': the QRAM chain a, tau_0 m_0 tau_1 m_1 ..., with t and the phase qubit in the middle of the cells,
+      for the a/tau/m/t/phase layout of the Bucket-Brigade QRAM (falls back to 'rcm' otherwise);
+    - 'auto' (the default): whichever of the two gives the smaller span of the gates along the chain.
+
+mps_test reports the bond dimension between every pair of neighbouring qubits of the chain (and whether
+max_bond truncated it), and, for inputs small enough, cross-checks the address probabilities against the
+statevector simulator, raising MPSCrossCheckError instead of returning a wrong result. Aer checks the memory
+of an MPS simulation against bond dimensions bounded by the chain alone (2^(num_qubits // 2)), far above what
+resources.py projects from the branching qubits (412316866560 MB against 0.02 GB for the 48 qubits of
+[1, 5, 7, 10, 2, 3, 9, 6] unoptimized). mps_test therefore checks the projection of resources.py against the
+memory budget itself, and passes max_memory_mb to Aer so that its own check does not reject the simulation.
+
+Usage:
+    report = mps_test([1, 5, 7, 10, 2, 3, 9, 6])
+'''
+
+import numpy as np
+from qiskit import QuantumCircuit, ClassicalRegister, transpile
+from qiskit.exceptions import QiskitError
+from circuit_cache import default_cache
+from resources import flatten, estimate_resources, available_memory, mps_memory, format_report, \
+    InsufficientMemoryError
+import instrument
+
+
+# Raised when the MPS simulation disagrees with the statevector simulation; report holds both distributions
+class MPSCrossCheckError(RuntimeError):
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
+# Returns the interaction graph of circuit, as {qubit: {neighbour: number of gates acting on both}}
+def interaction_graph(circuit):
+    graph = {q: {} for q in range(circuit.num_qubits)}
+    for name, qubits in flatten(circuit):
+        if name == 'barrier':
+            continue
+        for i in qubits:
+            for j in qubits:
+                if i != j:
+                    graph[i][j] = graph[i].get(j, 0) + 1
+    return graph
+
+
+# Returns the reverse Cuthill-McKee ordering of graph: a breadth-first search from a qubit of lowest degree
+# (in every connected component), visiting the neighbours by increasing degree, then reversed
+def reverse_cuthill_mckee(graph):
+    degree = {q: len(neighbours) for q, neighbours in graph.items()}
+    visited = set()
+    order = []
+    for start in sorted(graph, key=lambda q: (degree[q], q)):
+        if start in visited:
+            continue
+        visited.add(start)
+        queue = [start]
+        while queue:
+            q = queue.pop(0)
+            order.append(q)
+            for neighbour in sorted(graph[q], key=lambda p: (degree[p], p)):
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    queue.append(neighbour)
+    order.reverse()
+    return order
+
+
+# Returns the QRAM chain of a circuit laid out as a (n), tau (2^n), m (m*2^n, absent after optimize.py),
+# t (m) and possibly a phase qubit, or None if num_qubits does not match this layout
+def qram_chain(n, m, num_qubits):
+    rest = num_qubits - n - 2 ** n - m
+    cells = m * 2 ** n if rest >= m * 2 ** n else 0
+    if rest - cells not in (0, 1):
+        return None
+    tau = n
+    memory = n + 2 ** n
+    target = memory + cells
+    blocks = []
+    for k in range(2 ** n):     # each tau_k next to the memory cells it reads
+        blocks.append([tau + k] + [memory + k * m + l for l in range(m)] if cells else [tau + k])
+    middle = [target + l for l in range(m)] + list(range(target + m, num_qubits))       # t and phase
+    half = len(blocks) // 2
+    chain = list(range(n))
+    for block in blocks[:half]:
+        chain += block
+    chain += middle
+    for block in blocks[half:]:
+        chain += block
+    return chain
+
+
+# Returns the order of the qubits of circuit along the MPS chain (order[i] is the qubit placed at position i)
+# layout is 'rcm', 'qram' (needs n and m, and falls back to 'rcm' if the circuit does not match), 'auto' (the
+# one of the two with the smaller chain_span, 'rcm' on a tie) or 'none'
+def layout_order(circuit, layout='auto', n=None, m=None):
+    if layout == 'auto':
+        orders = [layout_order(circuit, name, n, m) for name in ('rcm', 'qram')]
+        return min(orders, key=lambda order: chain_span(circuit, order))
+    if layout == 'none':
+        return list(range(circuit.num_qubits))
+    if layout == 'qram':
+        chain = qram_chain(n, m, circuit.num_qubits)
+        if chain is not None:
+            return chain
+    elif layout != 'rcm':
+        raise ValueError("Unknown MPS layout '{}'".format(layout))
+    return reverse_cuthill_mckee(interaction_graph(circuit))
+
+
+# Returns the largest distance along the chain between two qubits acting in the same gate
+def chain_span(circuit, order):
+    position = {q: i for i, q in enumerate(order)}
+    return max((max(position[q] for q in qubits) - min(position[q] for q in qubits)
+                for _, qubits in flatten(circuit) if len(qubits) > 1), default=0)
+
+
+# Returns circuit with its qubits relabelled, qubit order[i] becoming qubit i
+def apply_layout(circuit, order):
+    position = {circuit.qubits[q]: i for i, q in enumerate(order)}
+    laid = QuantumCircuit(circuit.num_qubits, circuit.num_clbits, global_phase=circuit.global_phase)
+    clbits = {bit: i for i, bit in enumerate(circuit.clbits)}
+    for op, qargs, cargs in circuit.data:
+        laid.append(op, [laid.qubits[position[q]] for q in qargs], [laid.clbits[clbits[c]] for c in cargs])
+    return laid
+
+
+# Returns the bond dimensions of an MPS saved by save_matrix_product_state, between each pair of neighbours
+def bond_dimensions(mps_data):
+    _, lambdas = mps_data
+    return [len(values) for values in lambdas]
+
+
+# Simulates the circuit of input_vector with the matrix_product_state simulator, after the layout pass
+# max_bond and truncation are the maximum bond dimension (None: unbounded) and the truncation threshold of Aer;
+# n_shots measures the address qubits that many times (None: only the probabilities are saved)
+# If cross_check and the circuit has at most check_qubits qubits, the address probabilities are compared with
+# the statevector simulator, and MPSCrossCheckError is raised if their total variation distance exceeds tol
+# If the MPS projection of resources.py exceeds budget bytes (default: the available memory), or Aer rejects the
+# simulation nonetheless, resources.InsufficientMemoryError is raised
+# mode, optimize, exact and serial are passed to main.prepare_circuit
+# Returns a report with the address probabilities (and counts), the layout and the bond dimensions
+def mps_test(input_vector, layout='auto', max_bond=None, truncation=1e-16, n_shots=None, cross_check=True,
+             check_qubits=20, tol=1e-3, cache=default_cache, mode='bucket_brigade', optimize=True, exact=False,
+             serial=False, seed=None, budget=None):
+    from main import prepare_circuit, _run
+    from qiskit.providers.aer import AerSimulator
+    circuit, n = prepare_circuit(input_vector, cache=cache, mode=mode, optimize=optimize, exact=exact,
+                                 serial=serial)
+    m = int(max(input_vector)).bit_length()
+    with instrument.stage('mps.layout', layout=layout) as s:
+        order = layout_order(circuit, layout, n, m)
+        laid = apply_layout(circuit, order)
+        s.circuit(laid)
+    position = {q: i for i, q in enumerate(order)}
+    address = [position[q] for q in range(n)]
+
+    # the projection of resources.py decides whether the simulation fits; Aer's bound is only raised to let it run
+    projected = estimate_resources(input_vector, mode, count_gates=False, optimize=optimize, exact=exact,
+                                   serial=serial)
+    budget = available_memory() if budget is None else budget
+    if projected['memory']['matrix_product_state'] > budget:
+        raise InsufficientMemoryError("The MPS simulation does not fit in {:.2f} GB:\n".format(budget / 1024 ** 3)
+                                      + format_report(projected), projected)
+    options = {'matrix_product_state_truncation_threshold': truncation,
+               'max_memory_mb': 2 * -(-mps_memory(circuit.num_qubits) // 1024 ** 2)}     # Aer adds a bit more
+    if max_bond is not None:
+        options['matrix_product_state_max_bond_dimension'] = max_bond
+    sim = AerSimulator(method='matrix_product_state', **options)
+    qc = transpile(laid, sim)
+    qc.save_probabilities(address, label='probabilities')
+    qc.save_matrix_product_state(label='mps')
+    if n_shots is not None:
+        meas = ClassicalRegister(n)
+        qc.add_register(meas)
+        qc.measure(address, meas)
+    result = _run(sim, qc, shots=n_shots or 1, seed_simulator=seed)
+    try:
+        data = result.data(0)
+    except QiskitError as error:
+        if 'Insufficient memory' not in str(error):
+            raise
+        raise InsufficientMemoryError("Aer rejected the {}-qubit MPS simulation of input_vector {}: {}".format(
+            circuit.num_qubits, input_vector, error), {'input_vector': list(input_vector),
+                                                        'num_qubits': circuit.num_qubits}) from error
+    bonds = bond_dimensions(data['mps'])
+    report = {'input_vector': list(input_vector), 'num_qubits': circuit.num_qubits, 'layout': layout,
+              'order': order, 'span_before': chain_span(circuit, range(circuit.num_qubits)),
+              'span_after': chain_span(circuit, order), 'bond_dimensions': bonds,
+              'max_bond_dimension': max(bonds, default=1),
+              'truncated': max_bond is not None and max(bonds, default=1) >= max_bond,
+              'probabilities': np.asarray(data['probabilities'])}
+    if n_shots is not None:
+        report['counts'] = result.get_counts()
+
+    if cross_check and circuit.num_qubits <= check_qubits:
+        reference = circuit.copy()
+        reference.save_probabilities(list(range(n)), label='probabilities')
+        sv_sim = AerSimulator(method='statevector')
+        expected = np.asarray(_run(sv_sim, transpile(reference, sv_sim)).data(0)['probabilities'])
+        distance = 0.5 * float(np.sum(np.abs(expected - report['probabilities'])))
+        report['cross_check'] = {'distance': distance, 'statevector': expected, 'passed': distance <= tol}
+        if distance > tol:
+            raise MPSCrossCheckError("MPS and statevector address probabilities differ by {:.2e} (tolerance "
+                                     "{:.0e}) for input_vector {}".format(distance, tol, input_vector), report)
+    return report
+
+
+# Returns a human-readable version of the report of mps_test
+def format_mps_report(report):
+    lines = ["input_vector {}: {} qubits, '{}' layout, largest gate span {} -> {}".format(
+        report['input_vector'], report['num_qubits'], report['layout'], report['span_before'],
+        report['span_after'])]
+    lines.append("bond dimensions: max {}{}, {}".format(
+        report['max_bond_dimension'], " (truncated)" if report['truncated'] else "", report['bond_dimensions']))
+    if 'cross_check' in report:
+        lines.append("statevector cross-check: distance {:.2e}, {}".format(
+            report['cross_check']['distance'], 'passed' if report['cross_check']['passed'] else 'FAILED'))
+    lines.append("address probabilities: {}".format(np.round(report['probabilities'], 3)))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    for vector in ([1, 5, 7, 10, 2, 3, 9, 6], [1, 5, 7, 10, 2, 3, 9, 6, 12, 4, 11, 0, 8, 13, 14, 15]):
+        print(format_mps_report(mps_test(vector)))
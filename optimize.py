@@ -0,0 +1,192 @@
+'''
+This file implements an optimization pass over the assembled circuit, run before transpile in Grovers_test.
+    - Constant propagation: the m register of QRAM only holds classical constants, set by X gates, read by
+      CCX(tau, m, t) and X'd back. The pass tracks the value of every qubit that is known to be in a basis
+      state, drops the X gates on those qubits, and folds them away when they are used as controls: each
+      CCX(tau, m, t) becomes a CX(tau, t) if the memory bit is 1, and disappears if it is 0. The bound RX(0) and
+      RX(pi) gates loading the data of oracle.QRAM_template are folded in the same way (RX(pi) = -iX).
+    - Qubit removal: qubits that are never touched by the remaining gates (e.g. the m*2^n memory qubits)
+      are dropped from the circuit.
+    - Inverse-pair cancellation: self-inverse gates acting on the same qubits with nothing in between (such
+      as the runs of inverse gates between consecutive QRAM blocks) are cancelled, recursively.
+Barriers are dropped, unless optimize_circuit is asked to keep them as boundaries (see checkpoint.py).
+'''
+
+import numpy as np
+from qiskit import QuantumCircuit
+from qiskit.circuit import ControlledGate
+from qiskit.circuit.library import XGate
+
+
+# gates that are their own inverse
+SELF_INVERSE = {'x', 'y', 'z', 'h', 'cx', 'cy', 'cz', 'ch', 'ccx', 'ccz', 'swap', 'cswap',
+                'mcx', 'mcx_gray', 'mcx_recursive', 'mcx_vchain'}
+
+
+def _is_mcx(op):
+    return isinstance(op, ControlledGate) and op.base_gate.name == 'x'
+
+
+# Expands the composite gates of the circuit (QRAM, VC, DIF, ORACLE, SUP_2, ...) down to multi-controlled X
+# gates and the gates that are kept as they are (controlled custom gates, gates without definition, 1-qubit
+# gates). Returns the list of (op, qubit indices) and the accumulated global phase
+def _flatten(circuit):
+    index = {bit: i for i, bit in enumerate(circuit.qubits)}
+    ops = []
+    phase = [circuit.global_phase]
+
+    def expand(circ, qubits):
+        local = {bit: i for i, bit in enumerate(circ.qubits)}
+        for op, qargs, _ in circ.data:
+            q = [qubits[local[bit]] for bit in qargs]
+            if (isinstance(op, ControlledGate) or op.definition is None or op.num_qubits == 1
+                    or op.name in ('barrier', 'measure', 'unitary')):
+                ops.append((op, q))
+            else:
+                phase[0] += op.definition.global_phase
+                expand(op.definition, q)
+
+    expand(circuit, [index[bit] for bit in circuit.qubits])
+    return ops, phase[0]
+
+
+# Returns k if the angle is bound to k*pi for an integer k, None otherwise
+def _pi_multiple(angle):
+    try:
+        k = float(angle) / np.pi
+    except TypeError:       # an unbound parameter
+        return None
+    return int(round(k)) if abs(k - round(k)) < 1e-9 else None
+
+
+# Constant propagation over the flattened gates, starting with every qubit known to be |0>
+# If keep_barriers, the barriers are kept, with the known qubits in |1> set before them, so that the state at
+# each barrier is the one of the original circuit
+# Returns the remaining gates and the global phase of the folded RX gates
+def _propagate(ops, num_qubits, keep_barriers=False):
+    known = {q: 0 for q in range(num_qubits)}       # qubit -> classical value, for qubits in a basis state
+    result = []
+    phase = 0.0
+
+    def materialize(q):     # the emitted circuit still holds |0> on a known qubit, apply its actual value
+        if q in known:
+            if known.pop(q):
+                result.append((XGate(), [q]))
+
+    for op, qubits in ops:
+        if op.name == 'barrier':
+            if keep_barriers:
+                for q in [q for q, value in known.items() if value]:
+                    materialize(q)
+                result.append((op, qubits))
+            continue
+        if op.name == 'x':
+            if qubits[0] in known:
+                known[qubits[0]] ^= 1
+            else:
+                result.append((op, qubits))
+            continue
+        if op.name == 'rx' and qubits[0] in known and _pi_multiple(op.params[0]) is not None:
+            k = _pi_multiple(op.params[0])      # RX(k*pi) = (-i)^k X^k
+            known[qubits[0]] ^= k & 1
+            phase -= k * np.pi / 2
+            continue
+
+        if _is_mcx(op):
+            k = op.num_ctrl_qubits
+            controls, target, extra = qubits[:k], qubits[k], qubits[k + 1:]
+            remaining = []
+            ctrl_state = ''
+            satisfied = True
+            for i, c in enumerate(controls):
+                wanted = (op.ctrl_state >> i) & 1
+                if c in known:
+                    if known[c] != wanted:      # the gate never fires
+                        satisfied = False
+                        break
+                else:
+                    remaining.append(c)
+                    ctrl_state = str(wanted) + ctrl_state
+            if not satisfied:
+                continue
+            if not remaining:       # the gate always fires, i.e. it is an X gate
+                if target in known:
+                    known[target] ^= 1
+                else:
+                    result.append((XGate(), [target]))
+                continue
+            materialize(target)
+            for q in extra:     # e.g. the clean ancillas of a v-chain MCX, which stay |0> after the gate
+                if known.get(q) == 1:
+                    materialize(q)
+            if len(remaining) == k:
+                result.append((op, qubits))
+            else:
+                result.append((XGate().control(len(remaining), ctrl_state=ctrl_state), remaining + [target]))
+            continue
+
+        for q in qubits:        # any other gate: the qubits are no longer known to be classical
+            materialize(q)
+        result.append((op, qubits))
+
+    for q in sorted(known):
+        materialize(q)
+    return result, phase
+
+
+def _same(op1, op2):
+    return (op1.name == op2.name and list(op1.params) == list(op2.params)
+            and getattr(op1, 'ctrl_state', None) == getattr(op2, 'ctrl_state', None))
+
+
+# Cancels pairs of identical self-inverse gates with no other gate on their qubits in between
+def _cancel(ops):
+    result = []
+    stacks = {}     # qubit -> indices in result of the gates on it
+    for op, qubits in ops:
+        if op.name in SELF_INVERSE or _is_mcx(op):
+            tops = {stacks[q][-1] if stacks.get(q) else None for q in qubits}
+            if len(tops) == 1:
+                j = tops.pop()
+                if j is not None and result[j] is not None:
+                    prev_op, prev_qubits = result[j]
+                    if prev_qubits == qubits and _same(prev_op, op):
+                        result[j] = None
+                        for q in qubits:
+                            stacks[q].pop()
+                        continue
+        for q in qubits:
+            stacks.setdefault(q, []).append(len(result))
+        result.append((op, qubits))
+    return [entry for entry in result if entry is not None]
+
+
+# Returns the optimized circuit, the list of the original indices of its qubits, and a report of the gate
+# and qubit counts before and after
+# The qubits in keep (e.g. the address qubits, which are measured) are kept even if no gate acts on them;
+# the kept qubits stay in their original order
+# If keep_barriers, the barriers stay in the optimized circuit (on the kept qubits) as boundaries that no gate
+# is folded or cancelled across, e.g. to split it into segments
+def optimize_circuit(circuit, keep=(), keep_barriers=False):
+    ops, global_phase = _flatten(circuit)
+    gates_before = len(ops)
+    ops, phase = _propagate(ops, circuit.num_qubits, keep_barriers)
+    ops = _cancel(ops)
+    global_phase += phase
+
+    used = set(keep)
+    for op, qubits in ops:
+        if op.name != 'barrier':
+            used.update(qubits)
+    kept = sorted(used)
+    new_index = {q: i for i, q in enumerate(kept)}
+
+    optimized = QuantumCircuit(len(kept), global_phase=global_phase)
+    for op, qubits in ops:
+        if op.name == 'barrier':
+            optimized.barrier([new_index[q] for q in qubits if q in new_index])
+        else:
+            optimized.append(op, [new_index[q] for q in qubits])
+    report = {'qubits_before': circuit.num_qubits, 'qubits_after': len(kept),
+              'gates_before': gates_before, 'gates_after': len(ops)}
+    return optimized, kept, report
@@ -6,150 +6,439 @@ alternating bitstring in the input vector.
 '''
 
 
-from qiskit import QuantumCircuit, assemble, transpile, QuantumRegister, ClassicalRegister
-from qiskit.providers.aer import AerSimulator
-from qiskit.visualization import plot_histogram
-import matplotlib.pyplot as plt
+from functools import lru_cache
+from qiskit import QuantumCircuit, transpile, QuantumRegister, ClassicalRegister
+from qiskit.circuit import ParameterVector
+import rendering
+import instrument
+import ancilla
 import numpy as np
 
 
 
 
+# Writes the values of input_vector on the m register (the same gates erase them afterwards)
+def _write_memory(QRAM_circ, input_vector, q_m, n, m):
+    for i in range(2**n):
+        value = input_vector[i]
+        value_bitstring = list(format(value, 'b').zfill(m))
+        value_bitstring.reverse()   # to iterate from LSB to MSB
+        for j in range(m):
+            if value_bitstring[j] == '1':
+                QRAM_circ.x(q_m[i*m + j])
+
+
+# Connects register a with tau (translation from address qubits to anciliary qubits): only tau_k is |1>,
+# k being the address
+def _decode_address(QRAM_circ, q_a, q_tau, n):
+    QRAM_circ.x(q_tau[0])      # initializes tau_0 to |1>
+    QRAM_circ.cx(q_a[0], q_tau[1])
+    QRAM_circ.cx(q_tau[1], q_tau[0])
+    base = 2
+    for i in range(1, n):
+        # Step 1: entangle the address qubit with each anciliary qubit where
+        #           the corresponding bit is 1
+        for j in range(2**i):
+            QRAM_circ.ccx(q_a[i], q_tau[j], q_tau[base+j])
+
+        # Step 2: use higher anciliary qubits to cancel the excitations of
+        #           lower ones
+        for j in range(2**i):
+            QRAM_circ.cx(q_tau[base+j], q_tau[j])
+        base *= 2
+
+
+# Recovers the state of tau register, undoing _decode_address
+def _recover_address(QRAM_circ, q_a, q_tau, n):
+    base = 2**n
+    for i in range(n-1, 0, -1):
+        base = base // 2
+        for j in range(2**i-1, -1, -1):
+            QRAM_circ.cx(q_tau[base+j], q_tau[j])
+
+        for j in range(2**i-1, -1, -1):
+            QRAM_circ.ccx(q_a[i], q_tau[j], q_tau[base+j])
+    QRAM_circ.cx(q_tau[1], q_tau[0])
+    QRAM_circ.cx(q_a[0], q_tau[1])
+    QRAM_circ.x(q_tau[0])
+
+
+# Returns the QRAM circuit storing input_vector, using Bucket-Brigade model
+# n is the number of address qubits, m is the length of each stored bitstring
+@instrument.traced('QRAM')
+def QRAM_circuit(input_vector, n, m):
+    q_a = QuantumRegister(n, name='a')
+    q_tau = QuantumRegister(2**n, name='tau')
+    q_m = QuantumRegister(m*2**n, name='m')
+    q_target = QuantumRegister(m, name='t')
+    QRAM_circ = QuantumCircuit(q_a, q_tau, q_m, q_target, name='QRAM')
+    # consists of a, tau, m, target registers
+
+    # First, write on the m register using values from input_vector
+    _write_memory(QRAM_circ, input_vector, q_m, n, m)
+
+    # QRAM_circ.barrier()
+    # Then, connect register a with tau (translation from address qubits to anciliary qubits)
+    _decode_address(QRAM_circ, q_a, q_tau, n)
+    # QRAM_circ.barrier()
+
+
+    # Extract the value in m register using anciliary qubits
+    for k in range(2**n):
+        for l in range(m):
+            QRAM_circ.ccx(q_tau[k], q_m[k*m + l], q_target[l])
+
+
+    # Then recover the state of tau register
+    _recover_address(QRAM_circ, q_a, q_tau, n)
+
+    # And also recover m register
+    _write_memory(QRAM_circ, input_vector, q_m, n, m)
+
+    rendering.request(QRAM_circ, "QRAM circuit for input_vector " + str(input_vector) + "; 'QRAM' gate", 'QRAM.svg')
+
+    return QRAM_circ
+
+
+# Returns the depth-optimized QRAM circuit storing input_vector, with the same effect as QRAM_circuit
+# In QRAM_circuit, the m*2^n CCX gates of the read-out are already pipelined (the m gates of an address target
+# different t qubits), so the read-out has depth about 2^n + m, but the 2^n addresses still run one after the
+# other on the t register. Here the t register is fanned out into copies C_0 (the t register itself) ~
+# C_{copies-1} (the tc register, left clean): copy c reads the block of addresses {k : k mod copies = c}, all
+# blocks in parallel, and a log-depth XOR tree merges the copies into C_0. The tree is then undone on the other
+# copies only (C_0 is never a control of the tree), so they can unread their blocks and get back to |0>.
+# The address decoding is unchanged and dominates the depth, so the gain is modest (see parallel_copies)
+# copies defaults to parallel_copies(n, m); with 1 copy, the circuit is QRAM_circuit
+@instrument.traced('QRAM_parallel')
+def QRAM_parallel_circuit(input_vector, n, m, copies=None):
+    copies = parallel_copies(n, m) if copies is None else max(1, min(copies, 2**n))
+    q_a = QuantumRegister(n, name='a')
+    q_tau = QuantumRegister(2**n, name='tau')
+    q_m = QuantumRegister(m*2**n, name='m')
+    q_copies = QuantumRegister(m*(copies-1), name='tc')
+    q_target = QuantumRegister(m, name='t')
+    registers = [q_a, q_tau, q_m, q_copies, q_target] if copies > 1 else [q_a, q_tau, q_m, q_target]
+    QRAM_circ = QuantumCircuit(*registers, name='QRAM')
+    # consists of a, tau, m, target copies and target registers
+
+    def copy(c):
+        return q_target if c == 0 else q_copies[(c-1)*m:c*m]
+
+    tree = xor_tree(copies)
+
+    _write_memory(QRAM_circ, input_vector, q_m, n, m)
+    _decode_address(QRAM_circ, q_a, q_tau, n)
+
+    # reads the blocks, the addresses k ~ k+copies-1 being read by different copies in parallel
+    for k in range(0, 2**n, copies):
+        for c in range(min(copies, 2**n - k)):
+            for l in range(m):
+                QRAM_circ.ccx(q_tau[k+c], q_m[(k+c)*m + l], copy(c)[l])
+    for level in tree:      # merges the copies into C_0
+        for target, control in level:
+            for l in range(m):
+                QRAM_circ.cx(copy(control)[l], copy(target)[l])
+    for level in reversed(tree):        # undoes the tree on C_1 ~ C_{copies-1}
+        for target, control in level:
+            if target != 0:
+                for l in range(m):
+                    QRAM_circ.cx(copy(control)[l], copy(target)[l])
+    # unreads the blocks of C_1 ~ C_{copies-1} (C_0 keeps the value)
+    for k in range(0, 2**n, copies):
+        for c in range(1, min(copies, 2**n - k)):
+            for l in range(m):
+                QRAM_circ.ccx(q_tau[k+c], q_m[(k+c)*m + l], copy(c)[l])
+
+    _recover_address(QRAM_circ, q_a, q_tau, n)
+    _write_memory(QRAM_circ, input_vector, q_m, n, m)
+
+    rendering.request(QRAM_circ, "Depth-optimized QRAM circuit for input_vector " + str(input_vector)
+                      + "; 'QRAM' gate", 'QRAM_parallel.svg')
+    return QRAM_circ
+
+
+# Returns the levels of the XOR tree merging the copies into C_0: C_i ^= C_(i+step) for each i multiple of 2*step
+def xor_tree(copies):
+    tree = []
+    step = 1
+    while step < copies:
+        tree.append([(i, i + step) for i in range(0, copies - step, 2 * step)])
+        step *= 2
+    return tree
+
+
+# Returns the number of qubits of the tc register of QRAM_parallel_circuit that optimize.py keeps: the bits of the
+# copies that read a set memory bit, or that the XOR tree merges such a bit into (the others stay |0>)
+def live_copy_qubits(input_vector, n, m, copies):
+    live = [{l for k in range(c, 2**n, copies) for l in range(m) if int(input_vector[k]) >> l & 1}
+            for c in range(copies)]
+    for level in xor_tree(copies):
+        for target, control in level:
+            live[target] |= live[control]
+    return sum(len(bits) for bits in live[1:])
+
+
+# Returns the number of copies of the t register (a power of 2, up to 2^n) for which QRAM_parallel_circuit
+# has the smallest depth once transpiled into basis_gates, measured on the vector with every memory bit set,
+# among the ones whose depth reduction over a single copy is worth their m*(copies - 1) extra qubits: at least
+# min_gain_per_qubit of the depth for each of them. On a tie, the fewest copies. For n = 3, 8 copies are only 5%
+# shallower for 21 extra qubits (m = 3), so this returns 1, i.e. the read-out of QRAM_circuit, as for n <= 2;
+# from n = 4, 8 copies are 12% to 17% shallower. min_gain_per_qubit=0 picks the smallest depth at any cost
+@lru_cache(maxsize=None)
+def parallel_copies(n, m, basis_gates=('u', 'cx'), min_gain_per_qubit=0.005):
+    depths = {}
+    copies = 1
+    while copies <= 2**n:
+        circuit = QRAM_parallel_circuit([2**m - 1] * 2**n, n, m, copies)
+        depths[copies] = transpile(circuit, basis_gates=list(basis_gates)).depth()
+        copies *= 2
+    worth = [c for c in depths if 1 - depths[c] / depths[1] >= min_gain_per_qubit * m * (c - 1)]
+    return min(worth, key=lambda c: (depths[c], c))
+
+
+# Returns the depth of the QRAM circuit and of the depth-optimized one (with copies copies of the t
+# register) storing input_vector, before and after transpiling into basis_gates, and the number of qubits
+# copies defaults to parallel_copies(n, m)
+def QRAM_depth_report(input_vector, copies=None, basis_gates=('u', 'cx')):
+    n = int(np.log2(len(input_vector)))
+    m = int(np.log2(max(input_vector))) + 1
+    report = {}
+    for name, circuit in (('bucket_brigade', QRAM_circuit(input_vector, n, m)),
+                          ('parallel', QRAM_parallel_circuit(input_vector, n, m, copies))):
+        report[name] = {'num_qubits': circuit.num_qubits, 'depth': circuit.depth(),
+                        'transpiled_depth': transpile(circuit, basis_gates=list(basis_gates)).depth()}
+    before, after = report['bucket_brigade']['transpiled_depth'], report['parallel']['transpiled_depth']
+    report['depth_reduction'] = 1 - after / before
+    return report
+
+
+# Returns the QROM circuit storing input_vector, which loads the values by unary iteration over the addresses
+# instead of storing them in a memory register, so only n + 1 + m qubits are needed (instead of
+# n + 2^n + m*2^n + m for the Bucket-Brigade QRAM)
+# For each address i with a nonzero value, the flag qubit is set if the address register reads i, and the flag
+# then writes the bits of the value onto the t register; the circuit is its own inverse, like QRAM_circuit
+@instrument.traced('QROM')
+def QROM_circuit(input_vector, n, m):
+    q_a = QuantumRegister(n, name='a')
+    q_f = QuantumRegister(1, name='f')      # flag qubit, |1> only while the address matches
+    q_target = QuantumRegister(m, name='t')
+    QROM_circ = QuantumCircuit(q_a, q_f, q_target, name='QROM')
+    # consists of a, flag, target registers, with the same a and t wiring as QRAM
+
+    flipped = 0     # the address qubits currently flipped by X gates
+    for i in range(2**n):
+        value = input_vector[i]
+        if value == 0:      # nothing to write for this address
+            continue
+        # Step 1: flip the address qubits whose bit is 0 in i, so that address i reads |11...1>
+        # (only the bits that differ from the previous address need to be flipped)
+        wanted = (2**n - 1) ^ i
+        for k in range(n):
+            if ((flipped ^ wanted) >> k) & 1:
+                QROM_circ.x(q_a[k])
+        flipped = wanted
+
+        # Step 2: write the value onto the t register, directly if it has a single 1 bit, otherwise
+        # through the flag qubit
+        bits = [l for l in range(m) if (value >> l) & 1]
+        if len(bits) == 1:
+            QROM_circ.mcx(list(q_a), q_target[bits[0]])
+        else:
+            QROM_circ.mcx(list(q_a), q_f[0])
+            for l in bits:
+                QROM_circ.cx(q_f[0], q_target[l])
+            QROM_circ.mcx(list(q_a), q_f[0])
+
+    # Finally, recover the address qubits
+    for k in range(n):
+        if (flipped >> k) & 1:
+            QROM_circ.x(q_a[k])
+
+    rendering.request(QROM_circ, "QROM circuit for input_vector " + str(input_vector) + "; 'QROM' gate", 'QROM.svg')
+    return QROM_circ
+
+
+# Returns the Bucket-Brigade QRAM circuit for any input vector of length 2^n with m-bit values, where the X
+# gates writing (and erasing) the values in the m register are replaced by RX(data[i*m + j]) gates, data being
+# a ParameterVector: binding data[i*m + j] to pi if bit j of input_vector[i] is 1, and to 0 otherwise, gives
+# the same circuit as QRAM_circuit(input_vector, n, m). The global phase gets +data[i*m + j]/2 per gate, as
+# RX(pi) = -iX; input_vector is ignored, it only keeps the signature of the other lookup circuits
+@instrument.traced('QRAM_template')
+def QRAM_template(input_vector, n, m):
+    # the pseudo-vector with every memory bit set, so that every data-load gate is present
+    qram = QRAM_circuit([2**m - 1] * 2**n, n, m)
+    data = ParameterVector('data', m * 2**n)
+    memory = {bit: k for k, bit in enumerate(qram.qregs[2])}       # the m register
+    template = QuantumCircuit(*qram.qregs, name='QRAM')
+    for op, qargs, cargs in qram.data:
+        if op.name == 'x' and qargs[0] in memory:
+            k = memory[qargs[0]]
+            template.rx(data[k], qargs[0])
+            template.global_phase += data[k] / 2
+        else:
+            template.append(op, qargs, cargs)
+    return template
+
+
+# Returns the values to bind to the data parameters of QRAM_template to store input_vector, keyed by name
+def QRAM_data(input_vector, m):
+    return {'data[{}]'.format(i * m + j): np.pi if (value >> j) & 1 else 0.0
+            for i, value in enumerate(input_vector) for j in range(m)}
+
+
+# the circuits that can be used to look up the value stored at an address, all of them with the address
+# register first and the t register last, so that the oracle is wired in the same way
+LOOKUP_CIRCUITS = {'bucket_brigade': QRAM_circuit, 'qrom': QROM_circuit, 'template': QRAM_template,
+                   'parallel': QRAM_parallel_circuit}
+
+
+# Returns the verification circuit, adding the extra pi phase to solution address states
+# m is the length of each stored bitstring, input_vector is only used in the title of the diagram
+# n_ancillas is the number of clean ancillas the MCX can use (see ancilla.py), wired after the phase qubit
+@instrument.traced('VC')
+def VC_circuit(input_vector, m, type=0, n_ancillas=0):
+    # There are 3 different types of VC, namely VC_0, VC_1, and VC_2
+    # since the value qubits need to be accessed twice for n = 2, the circuit is now 
+    # designed to not change the state of value qubits (which are connected to the
+    # t register of QRAM)
+
+    q_val = QuantumRegister(m, name='val')      # value qubits
+    q_p = QuantumRegister(1, name='p')          # phase qubit, already initialized to |-> 
+    q_anc = QuantumRegister(n_ancillas, name='anc')     # clean ancillas, left in |0>
+    VC_circ = QuantumCircuit(q_val, q_p, q_anc) if n_ancillas else QuantumCircuit(q_val, q_p)
+
+    # First, check if the bitstring is alternating
+    for i in range(m-1):
+        VC_circ.cx(q_val[i+1], q_val[i])
+
+    # Then, add |1> to phase qubit if it's alternating, completing the phase kickback
+    if type == 1:     # for VC_1, do the phase flip only for the solution starting with |0>
+                        # (i.e. |0101010...>)
+        VC_circ.x(q_val[m-1])
+        ancilla.mcx(VC_circ, list(range(m)), q_p[0], q_anc)
+        VC_circ.x(q_val[m-1])
+    elif type == 2:     # for VC_2, do the phase flip only for the solution starting with |1>
+                        # (i.e. |101010101...>)
+        ancilla.mcx(VC_circ, list(range(m)), q_p[0], q_anc)
+    else:
+        type = 0
+        ancilla.mcx(VC_circ, list(range(m - 1)), q_p[0], q_anc)     # otherwise, do the flip for both solutions
+
+    # Finally, recover the previous value state
+    for j in range(m-2, -1, -1):
+        VC_circ.cx(q_val[j+1], q_val[j])
+
+    rendering.request(VC_circ, "Type {} verification circuit, for input vector ".format(type) + str(input_vector)
+                      + "; 'VC_{}' gate".format(type), 'vc_{}.svg'.format(type))
+    return VC_circ
+
+
+# Returns the verification circuit with an adjustable phase: instead of the pi phase kicked back from the phase
+# qubit, e^(i*phase) is added to the solution address states by a multi-controlled phase gate on the value
+# qubits themselves, so no phase qubit is needed (phase = pi gives the same effect as VC_0)
+# type selects the solutions like in VC_circuit: 0 for both, 1 for |0101...> and 2 for |1010...>
+# If flagged, a flag qubit (after the value qubits) selects the type instead: type 1 if the flag is |0>, and
+# type 2 if it is |1>
+@instrument.traced('VC_phase')
+def phase_VC_circuit(input_vector, m, phase=np.pi, type=0, flagged=False):
+    q_val = QuantumRegister(m, name='val')      # value qubits
+    q_flag = QuantumRegister(1, name='f')       # class flag qubit
+    VC_circ = QuantumCircuit(q_val, q_flag, name='VC_phase') if flagged else QuantumCircuit(q_val, name='VC_phase')
+    if flagged:
+        type = 1        # the first bit is XOR-ed with the flag, so it must read |0> for both classes
+
+    # First, check if the bitstring is alternating, in the same way as VC_circuit
+    for i in range(m-1):
+        VC_circ.cx(q_val[i+1], q_val[i])
+    if flagged:
+        VC_circ.cx(q_flag[0], q_val[m-1])
+
+    # Then, add the phase if qubit 0~m-2 are all |1> (and, for type 1 and 2, if qubit m-1 is |0> or |1>)
+    qubits = list(range(m - 1)) if type == 0 else list(range(m))
+    if type == 1:
+        VC_circ.x(q_val[m-1])
+    if not qubits:      # every 1-bit string is alternating
+        VC_circ.global_phase += phase
+    elif len(qubits) == 1:
+        VC_circ.p(phase, q_val[qubits[0]])
+    else:
+        VC_circ.mcp(phase, qubits[:-1], qubits[-1])
+    if type == 1:
+        VC_circ.x(q_val[m-1])
+
+    # Finally, recover the previous value state
+    if flagged:
+        VC_circ.cx(q_flag[0], q_val[m-1])
+    for j in range(m-2, -1, -1):
+        VC_circ.cx(q_val[j+1], q_val[j])
+
+    name = 'flagged' if flagged else type
+    rendering.request(VC_circ, "Type {} phase verification circuit, for input vector ".format(name)
+                      + str(input_vector) + "; 'VC_phase' gate", 'vc_phase_{}.svg'.format(name))
+    return VC_circ
+
+
+# Returns the oracle adding e^(i*phase) to the solution address states, for any n
+# It consists of QRAM, phase_VC and another QRAM, without the phase qubit of oracle_circuit
+# type and flagged are passed to phase_VC_circuit; if flagged, the flag qubit is the last qubit of the oracle
+@instrument.traced()
+def phase_oracle_circuit(input_vector, phase=np.pi, mode='bucket_brigade', type=0, flagged=False):
+    n = int(np.log2(len(input_vector)))
+    m = int(np.log2(max(input_vector))) + 1
+    if mode not in LOOKUP_CIRCUITS:
+        raise ValueError("Unknown QRAM mode '{}'".format(mode))
+    qram = LOOKUP_CIRCUITS[mode](input_vector, n, m)
+    n_qubits = qram.num_qubits
+    vc = phase_VC_circuit(input_vector, m, phase, type, flagged).to_gate(label='VC_phase')
+    qram = qram.to_gate(label=qram.name)
+
+    oracle = QuantumCircuit(n_qubits + 1 if flagged else n_qubits)
+    oracle.append(qram, list(range(n_qubits)))
+    oracle.append(vc, list(range(n_qubits - m, oracle.num_qubits)))
+    oracle.append(qram, list(range(n_qubits)))
+    return oracle
+
+
 # Input: input_vector, the initial input vector [1, 5, 7, 10] to determine m, n and initialize QRAM.
+#        mode, the construction of the QRAM, either 'bucket_brigade' (default), 'qrom' (see QROM_circuit) or
+#        'parallel' (see QRAM_parallel_circuit)
+#        ancillas, whether the MCX of VC borrows the work qubits of the lookup, which are clean while VC runs
+#        (the VC circuits then have extra ancilla qubits after the phase qubit, see ancilla.py)
 # Output: 
 #   - if n = 2, returns a tuple consisting of QRAM, VC_1, VC_2, m, and n
 #   - otherwise, returns a tuple consisting of oracle, None, None, m, and n 
-def oracle_circuit(input_vector):
+@instrument.traced()
+def oracle_circuit(input_vector, mode='bucket_brigade', ancillas=True):
     n = int(np.log2(len(input_vector)))         # the number of address qubits
     m = int(np.log2(max(input_vector))) + 1     # the length of each bitstring, determined by the
                                                 # largest value in input_vector
-    def QRAM():     # internal function to create the QRAM circuit, using Bucket-Brigade model
-        q_a = QuantumRegister(n, name='a')
-        q_tau = QuantumRegister(2**n, name='tau')
-        q_m = QuantumRegister(m*2**n, name='m')
-        q_target = QuantumRegister(m, name='t')
-        QRAM_circ = QuantumCircuit(q_a, q_tau, q_m, q_target)
-        # consists of a, tau, m, target registers
-
-        # First, write on the m register using values from input_vector
-        for i in range(2**n):
-            value = input_vector[i]
-            value_bitstring = list(format(value, 'b').zfill(m))
-            value_bitstring.reverse()   # to iterate from LSB to MSB
-            for j in range(m):
-                if value_bitstring[j] == '1':
-                    QRAM_circ.x(q_m[i*m + j])
-        
-        # QRAM_circ.barrier()
-        # Then, connect register a with tau (translation from address qubits to anciliary qubits)
-        QRAM_circ.x(q_tau[0])      # initializes tau_0 to |1>
-        QRAM_circ.cx(q_a[0], q_tau[1])
-        QRAM_circ.cx(q_tau[1], q_tau[0])
-        base = 2
-        for i in range(1, n):
-            # Step 1: entangle the address qubit with each anciliary qubit where
-            #           the corresponding bit is 1
-            for j in range(2**i):
-                QRAM_circ.ccx(q_a[i], q_tau[j], q_tau[base+j])
-
-            # Step 2: use higher anciliary qubits to cancel the excitations of
-            #           lower ones
-            for j in range(2**i):
-                QRAM_circ.cx(q_tau[base+j], q_tau[j])
-            base *= 2
-        # QRAM_circ.barrier()
-
-
-        # Extract the value in m register using anciliary qubits
-        for k in range(2**n):
-            for l in range(m):
-                QRAM_circ.ccx(q_tau[k], q_m[k*m + l], q_target[l])
-        
-
-        # Then recover the state of tau register
-        for i in range(n-1, 0, -1):
-            base = base // 2
-            for j in range(2**i-1, -1, -1):
-                QRAM_circ.cx(q_tau[base+j], q_tau[j])
-            
-            for j in range(2**i-1, -1, -1):
-                QRAM_circ.ccx(q_a[i], q_tau[j], q_tau[base+j])              
-        QRAM_circ.cx(q_tau[1], q_tau[0])
-        QRAM_circ.cx(q_a[0], q_tau[1])
-        QRAM_circ.x(q_tau[0])
-
-        # And also recover m register
-        for i in range(2**n):
-            value = input_vector[i]
-            value_bitstring = list(format(value, 'b').zfill(m))
-            value_bitstring.reverse()   # to iterate from LSB to MSB
-            for j in range(m):
-                if value_bitstring[j] == '1':
-                    QRAM_circ.x(q_m[i*m + j])
-        
-        QRAM_circ.draw()
-        plt.title("QRAM circuit for input_vector " + str(input_vector) + "; 'QRAM' gate")
-        plt.savefig('.\circuit_diagrams\QRAM.svg')
-
-        return QRAM_circ
-    
-
-    def VC(type=0):     # internal function to create the verification circuit, adding the extra pi phase to
-                        # solution address states
-                        # There are 3 different types of VC, namely VC_0, VC_1, and VC_2
-                        # since the value qubits need to be accessed twice for n = 2, the circuit is now 
-                        # designed to not change the state of value qubits (which are connected to the
-                        # t register of QRAM)
-
-        q_val = QuantumRegister(m, name='val')      # value qubits
-        q_p = QuantumRegister(1, name='p')          # phase qubit, already initialized to |-> 
-        VC_circ = QuantumCircuit(q_val, q_p)
-
-        # First, check if the bitstring is alternating
-        for i in range(m-1):
-            VC_circ.cx(q_val[i+1], q_val[i])
-        
-        # Then, add |1> to phase qubit if it's alternating, completing the phase kickback
-        if type == 1:     # for VC_1, do the phase flip only for the solution starting with |0>
-                            # (i.e. |0101010...>)
-            VC_circ.x(q_val[m-1])
-            VC_circ.mcx(list(range(m)), q_p[0])
-            VC_circ.x(q_val[m-1])
-        elif type == 2:     # for VC_2, do the phase flip only for the solution starting with |1>
-                            # (i.e. |101010101...>)
-            VC_circ.mcx(list(range(m)), q_p[0])
-        else:
-            type = 0
-            VC_circ.mcx(list(range(m - 1)), q_p[0])     # otherwise, do the flip for both solutions
-        
-        # Finally, recover the previous value state
-        for j in range(m-2, -1, -1):
-            VC_circ.cx(q_val[j+1], q_val[j])
-
-        VC_circ.draw()
-        plt.title("Type {} verification circuit, for input vector ".format(type) + str(input_vector) + "; 'VC_{}' gate".format(type))
-        plt.savefig('.\circuit_diagrams\\vc_{}.svg'.format(type))
-        return VC_circ
-    
+    if mode not in LOOKUP_CIRCUITS:
+        raise ValueError("Unknown QRAM mode '{}'".format(mode))
+    qram = LOOKUP_CIRCUITS[mode](input_vector, n, m)
+    n_qubits = qram.num_qubits          # number of qubits used in QRAM
+    # the work qubits between the address and value registers are restored by the lookup, so they are clean
+    # while VC runs (only the ones optimize.py keeps are borrowed, see ancilla.surviving_work)
+    clean = ancilla.CleanQubits(ancilla.idle_first(ancilla.surviving_work(n, m, n_qubits)) if ancillas else [])
     if n == 2:      # in which case we assemble the components and
                     # go beyond the qubit limit
-        return QRAM(), VC(type=1), VC(type=2), m, n
+        n_anc = ancilla.ancillas_needed(m, clean.available())
+        return (qram, VC_circuit(input_vector, m, type=1, n_ancillas=n_anc),
+                VC_circuit(input_vector, m, type=2, n_ancillas=n_anc), m, n)
 
     # Now we deal with the case n != 2
     # Here we connect QRAM and VC together
-    vc = VC()
-    qram = QRAM()
-    n_qubits = qram.num_qubits          # number of qubits used in QRAM
-    vc = vc.to_gate(label='VC_0')
-    qram = qram.to_gate(label='QRAM')
+    vc_ancillas = clean.borrow(ancilla.ancillas_needed(m - 1, clean.available()))
+    vc = VC_circuit(input_vector, m, n_ancillas=len(vc_ancillas))
+    with instrument.stage('to_gate', gates='VC_0, ' + qram.name):
+        vc = vc.to_gate(label='VC_0')
+        qram = qram.to_gate(label=qram.name)
 
     oracle = QuantumCircuit(n_qubits + 1)       # since an extra phase qubit is needed for the oracle
     oracle.append(qram, list(range(n_qubits)))    
-    oracle.append(vc, list(range(n_qubits - m, n_qubits + 1)))
+    oracle.append(vc, list(range(n_qubits - m, n_qubits + 1)) + vc_ancillas)
     oracle.append(qram, list(range(n_qubits)))  # append another QRAM to restore state of t/val register
-    oracle.draw()
-    plt.title("Circuit diagram of the oracle for input vector " + str(input_vector) + ", with m = {} and n = {}; 'ORACLE' gate".format(m, n))
-    plt.savefig('.\circuit_diagrams\oracle.svg')
+    rendering.request(oracle, "Circuit diagram of the oracle for input vector " + str(input_vector)
+                      + ", with m = {} and n = {}; 'ORACLE' gate".format(m, n), 'oracle.svg')
 
     return oracle, None, None, m, n
 
@@ -158,6 +447,7 @@ def oracle_circuit(input_vector):
 
 # returns the bitstring stored in this address
 def oracle_test(address, oracle, m, n):
+    from qiskit.providers.aer import AerSimulator
     # m is length of each bitstring stored, n is number of address qubits
     address_bitstring = list(format(address, 'b').zfill(n))
     address_bitstring.reverse()
@@ -186,8 +476,7 @@ def oracle_test(address, oracle, m, n):
     qc.measure(list(range(n_qubits-m-1, n_qubits-1)), list(range(m)))       # measures the value state
                                                                             # after verification
 
-    qc.draw()
-    plt.savefig('test_circuit.svg')
+    rendering.render(qc, "Test circuit for address {}".format(address), 'test_circuit.svg')
     sim = AerSimulator(method='statevector')
     # DO NOT use the matrix_product_state simulator in any case!!!
     qc = transpile(qc, sim)
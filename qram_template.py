@@ -0,0 +1,109 @@
+'''
+This file implements reusable circuit templates for the QRAM-based circuit solving Task 1. For a fixed (n, m),
+the address-decoding tree, the CCX read-out grid and the uncomputation of QRAM, as well as VC, DIF, SUP_2 and
+the number of iterations, are the same for every input vector: only the X gates writing the input vector into
+the m register differ. oracle.QRAM_template replaces them by RX(data[k]) gates, with data[k] in {0, pi}, so the
+whole circuit is built and transpiled once per (n, m) (and cached, see circuit_cache.py), and a new input
+vector is swapped in by binding the data parameters, e.g. thousands of vectors in a single Aer job through
+parameter_binds.
+
+The templates themselves are not passed through optimize.py, whose constant propagation needs the actual
+values. With the sparse simulator, each bound circuit goes through optimize.py instead, like in
+main.prepare_circuit (the bound RX gates are folded like the X gates they stand for), so it is the default of
+run_vectors. The Aer job binds the parameters inside Aer, so it simulates the template as it is, m register
+included (30 qubits for [1, 5, 7, 10] and 48 for [1, 5, 7, 10, 2, 3, 9, 6], against 14 and 16 once
+optimized): it only pays off for many small vectors, and run_vectors refuses it when the statevector of the template does not fit in memory.
+
+Usage:
+    counts = run_vectors([[1, 5, 7, 10], [2, 5, 10, 3]])
+'''
+
+from qiskit import ClassicalRegister, transpile
+from circuit_cache import default_cache
+from oracle import QRAM_data
+from optimize import optimize_circuit
+from resources import estimate_resources, plan_simulation
+from sparse_sim import sparse_run, sparse_counts
+
+
+# Returns (n, m) of input_vector, the key of its template
+def template_shape(input_vector):
+    n = int(len(input_vector)).bit_length() - 1
+    m = int(max(input_vector)).bit_length()
+    return n, m
+
+
+# Returns the circuit template for (n, m), with the address qubits measured if measure (into n classical bits),
+# transpiled for sim if it is given; target identifies the simulator configuration in the cache key
+def template_circuit(n, m, sim=None, target='sparse', cache=default_cache, measure=False):
+    def build():
+        from main import Grovers_circuit
+        circ, _ = Grovers_circuit([2 ** m - 1] * 2 ** n, mode='template')
+        if sim is not None:
+            circ = transpile(circ, sim)
+        if measure:
+            meas = ClassicalRegister(n)
+            circ.add_register(meas)
+            circ.measure(list(range(n)), meas)
+        return circ
+
+    if cache is None:
+        return build()
+    return cache.get(('template', n, m, target, measure), build)
+
+
+# Returns the binding of the data parameters of template for input_vector, as a {Parameter: value} dictionary
+def bind_values(template, input_vector):
+    _, m = template_shape(input_vector)
+    values = QRAM_data(input_vector, m)
+    return {parameter: values[parameter.name] for parameter in template.parameters}
+
+
+# Returns the template with the data of input_vector bound, i.e. the circuit of Grovers_circuit(input_vector)
+def bind_vector(template, input_vector):
+    return template.assign_parameters(bind_values(template, input_vector))
+
+
+# Solves Task 1 for every input vector of vectors, which must all have the same (n, m), with a single template
+# method is 'sparse' (each bound circuit optimized and run by sparse_sim.py) or 'statevector' (all vectors in a
+# single Aer job through parameter_binds, on the unoptimized template)
+# If optimize, the bound circuits of the sparse simulator go through the pass in optimize.py
+# budget bounds the memory of the Aer job (default: the available memory), see resources.plan_simulation,
+# which raises InsufficientMemoryError if the template does not fit
+# Returns the list of the measured counts, in the same order as vectors
+def run_vectors(vectors, n_shots=8000, method='sparse', precision='single', cache=default_cache, seed=None,
+                optimize=True, budget=None):
+    shapes = {template_shape(vector) for vector in vectors}
+    if len(shapes) != 1:
+        raise ValueError("All input vectors must share the same (n, m), got {}".format(sorted(shapes)))
+    n, m = shapes.pop()
+
+    if method == 'sparse':
+        template = template_circuit(n, m, cache=cache)
+        counts = []
+        for vector in vectors:
+            circuit = bind_vector(template, vector)
+            if optimize:
+                circuit, _, _ = optimize_circuit(circuit, keep=range(n))
+            state, _ = sparse_run(circuit)
+            counts.append(sparse_counts(state, {i: i for i in range(n)}, n, n_shots, seed))
+        return counts
+
+    # the template keeps every qubit of Grovers_circuit, as if not optimized
+    report = estimate_resources(vectors[0], mode='template', count_gates=False)
+    plan_simulation(report, budget, '{}_{}'.format(method, precision))
+    from qiskit.providers.aer import AerSimulator
+    sim = AerSimulator(method=method, precision=precision)
+    template = template_circuit(n, m, sim, ('aer', method, precision), cache, measure=True)
+    binds = {parameter: [] for parameter in template.parameters}
+    for vector in vectors:
+        for parameter, value in bind_values(template, vector).items():
+            binds[parameter].append(value)
+    result = sim.run(template, shots=n_shots, parameter_binds=[binds], seed_simulator=seed).result()
+    return [result.get_counts(i) for i in range(len(vectors))]
+
+
+if __name__ == '__main__':
+    vectors = [[1, 5, 7, 10], [2, 5, 10, 3], [10, 9, 5, 8]]
+    for vector, counts in zip(vectors, run_vectors(vectors, method='sparse')):
+        print(vector, counts)
@@ -0,0 +1,185 @@
+'''
+This file implements a bit-parallel verifier for the QRAM circuit. Once the address is a basis state, QRAM
+only consists of X, CX and CCX gates, so it maps basis states to basis states and can be evaluated
+classically. Every qubit is represented as a NumPy bit-column over a batch of (input_vector, address) pairs,
+packed 64 pairs per word, and each gate becomes a few bitwise operations on these columns. This way, all
+2^n addresses of thousands of input vectors are pushed through the gate list in one pass.
+
+Like the old QRAM_debug in oracle.py, mismatches are reported as the positions of the flipped value bits.
+In addition, the verifier checks that the a/tau/m registers are restored after one QRAM, and that the t
+register is restored as well after a second QRAM (as in the oracle).
+'''
+
+import itertools
+import numpy as np
+from qiskit.circuit import ControlledGate
+from oracle import QRAM_circuit
+
+
+# Flattens the circuit into a list of classical reversible operations (controls, control values, target),
+# each of them being a multi-controlled X gate (a plain X gate has no controls)
+def classical_ops(circuit):
+    index = {bit: i for i, bit in enumerate(circuit.qubits)}
+    ops = []
+
+    def flatten(circ, qubits):
+        local = {bit: i for i, bit in enumerate(circ.qubits)}
+        for op, qargs, _ in circ.data:
+            q = [qubits[local[bit]] for bit in qargs]
+            if op.name == 'barrier':
+                continue
+            if op.name == 'x':
+                ops.append(((), (), q[0]))
+            elif isinstance(op, ControlledGate) and op.base_gate.name == 'x':
+                k = op.num_ctrl_qubits
+                values = tuple(bool((op.ctrl_state >> i) & 1) for i in range(k))
+                ops.append((tuple(q[:k]), values, q[k]))
+            elif op.definition is not None:
+                flatten(op.definition, q)
+            else:
+                raise ValueError("Gate '{}' is not classical reversible".format(op.name))
+
+    flatten(circuit, [index[bit] for bit in circuit.qubits])
+    return ops
+
+
+# Returns count random input vectors of length 2^n, whose largest value has exactly m bits
+def random_vectors(count, n, m, seed=None):
+    rng = np.random.default_rng(seed)
+    vectors = rng.integers(0, 2 ** m, size=(count, 2 ** n))
+    if m > 1:       # make sure that the largest value has m bits, so that oracle_circuit gets the same m
+        rows = np.arange(count)
+        vectors[rows, rng.integers(0, 2 ** n, size=count)] = rng.integers(2 ** (m - 1), 2 ** m, size=count)
+    else:
+        vectors[:, 0] = 1
+    return vectors
+
+
+# Returns all input vectors of length 2^n, whose largest value has exactly m bits
+def exhaustive_vectors(n, m):
+    vectors = [v for v in itertools.product(range(2 ** m), repeat=2 ** n) if max(v) >= 2 ** (m - 1)]
+    return np.array(vectors, dtype=np.int64)
+
+
+def _pack(bits):
+    packed = np.packbits(bits, bitorder='little')
+    packed = np.pad(packed, (0, -len(packed) % 8))
+    return packed.view(np.uint64)
+
+
+def _unpack(words, size):
+    return np.unpackbits(words.view(np.uint8), bitorder='little')[:size].astype(bool)
+
+
+# Merges the gate lists of QRAM circuits that only differ in their data-loading X gates (on the m register)
+# Returns a list of (operation, mask) pairs, where mask selects the batch rows the operation applies to
+# (None meaning all rows); masks[i] selects the rows of circuit i
+def _merge(op_lists, masks, data_qubits):
+    merged = []
+    pointers = [0] * len(op_lists)
+    while True:
+        active = [i for i in range(len(op_lists)) if pointers[i] < len(op_lists[i])]
+        if not active:
+            return merged
+        # data-loading X gates commute with each other, so they are emitted first, each masked to the rows
+        # of the circuits that contain them
+        loading = [i for i in active if not op_lists[i][pointers[i]][0] and op_lists[i][pointers[i]][2] in data_qubits]
+        group = loading if loading else active
+        ops = {}
+        for i in group:
+            ops.setdefault(op_lists[i][pointers[i]], []).append(i)
+            pointers[i] += 1
+        for op, circuits in ops.items():
+            if len(circuits) == len(op_lists):      # shared by all circuits, e.g. the address-decoding tree
+                merged.append((op, None))
+            else:
+                mask = masks[circuits[0]].copy()
+                for i in circuits[1:]:
+                    mask |= masks[i]
+                merged.append((op, mask))
+
+
+# Applies the merged operations on the packed bit-columns (one row of words per qubit)
+def _evaluate(merged, columns):
+    for (controls, values, target), mask in merged:
+        flip = np.full(columns.shape[1], np.iinfo(np.uint64).max, dtype=np.uint64) if mask is None else mask.copy()
+        for control, value in zip(controls, values):
+            flip &= columns[control] if value else ~columns[control]
+        columns[target] ^= flip
+
+
+# Verifies QRAM_circuit on all 2^n addresses of each input vector (one per row of vectors, sharing n and m)
+# Returns a dictionary with the number of checked (input_vector, address) pairs, the wrong values as
+# (vector index, address, flipped bits), and the registers not restored as (vector index, address, registers)
+def verify_qram(vectors, verbose=True):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.int64))
+    n = int(np.log2(vectors.shape[1]))
+    N = 2 ** n
+    m = int(np.log2(vectors.max())) + 1
+    n_vectors = vectors.shape[0]
+    size = n_vectors * N                    # row v * N + a is the pair (vectors[v], a)
+
+    # build the gate list of every distinct input vector, then merge them into one
+    op_lists = []
+    masks = []
+    cache = {}
+    for v in range(n_vectors):
+        key = tuple(vectors[v].tolist())
+        if key not in cache:
+            cache[key] = classical_ops(QRAM_circuit(list(key), n, m))
+        op_lists.append(cache[key])
+        rows = np.zeros(size, dtype=bool)
+        rows[v * N:(v + 1) * N] = True
+        masks.append(_pack(rows))
+    data_qubits = set(range(n + N, n + N + m * N))
+    merged = _merge(op_lists, masks, data_qubits)
+
+    # prepare the address qubits, all other qubits start in |0>
+    num_qubits = n + N + m * N + m
+    addresses = np.tile(np.arange(N), n_vectors)
+    columns = np.zeros((num_qubits, len(_pack(np.zeros(size, dtype=bool)))), dtype=np.uint64)
+    for i in range(n):
+        columns[i] = _pack((addresses >> i) & 1 == 1)
+    initial = columns.copy()
+
+    report = {'checked': size, 'value_errors': [], 'not_restored': []}
+    registers = {'a': range(0, n), 'tau': range(n, n + N), 'm': range(n + N, n + N + m * N),
+                 't': range(num_qubits - m, num_qubits)}
+
+    def check_restored(names):
+        wrong = {}
+        for name in names:
+            for q in registers[name]:
+                for row in np.flatnonzero(_unpack(columns[q] ^ initial[q], size)):
+                    wrong.setdefault(row, set()).add(name)
+        for row in sorted(wrong):
+            report['not_restored'].append((row // N, row % N, sorted(wrong[row])))
+
+    # after one QRAM, register t holds the value and the others are restored
+    _evaluate(merged, columns)
+    values = np.zeros(size, dtype=np.int64)
+    for l, q in enumerate(registers['t']):
+        values |= _unpack(columns[q], size).astype(np.int64) << l
+    wrong_bits = values ^ vectors.reshape(-1)
+    for row in np.flatnonzero(wrong_bits):
+        flipped = [j for j in range(m) if (wrong_bits[row] >> j) & 1]
+        report['value_errors'].append((row // N, row % N, flipped))
+    check_restored(['a', 'tau', 'm'])
+
+    # after a second QRAM, register t is restored too
+    _evaluate(merged, columns)
+    check_restored(['t'])
+
+    if verbose:
+        for v, address, flipped in report['value_errors']:
+            print("Vector {}, position {}, flipped bits: ".format(vectors[v].tolist(), address), flipped)
+        for v, address, names in report['not_restored']:
+            print("Vector {}, position {}, registers not restored: ".format(vectors[v].tolist(), address), names)
+        print("Checked {} (input_vector, address) pairs: {} wrong values, {} not restored.".format(
+            size, len(report['value_errors']), len(report['not_restored'])))
+    return report
+
+
+if __name__ == '__main__':
+    verify_qram([[1, 5, 7, 10]])
+    verify_qram(random_vectors(1000, 3, 4, seed=0))
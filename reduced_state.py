@@ -0,0 +1,68 @@
+'''
+This file extracts the state of the n address qubits from the final state of the circuit, without
+materializing extra copies of the full statevector. Grovers_test used to round the whole 2^30 statevector,
+build a partial_trace density matrix and take the square root of its diagonal, which doubles the memory of
+the simulation and throws away the phases.
+
+Instead, the statevector is viewed as a (2^(num_qubits-n), 2^n) array, one row per state of the ancillas
+(the address qubits being the lowest ones), and streamed in chunks of rows:
+    - the marginal probabilities of the address qubits are accumulated over the ancillas;
+    - since the ancillas are disentangled from the address qubits at the end of the circuit, the reduced state
+      is (ideally) pure, and its amplitudes, phases included, are given by the heaviest row, normalized;
+    - a second pass measures how close the reduced state is to that pure state (fidelity 1 if pure).
+'''
+
+import numpy as np
+
+
+CHUNK_SIZE = 2 ** 22        # number of amplitudes read at once
+
+
+# Fixes the global phase of the amplitudes, such that the largest one is real and positive
+def _fix_phase(amplitudes):
+    largest = amplitudes[np.argmax(np.abs(amplitudes))]
+    if largest != 0:
+        amplitudes = amplitudes * (abs(largest) / largest)
+    return amplitudes
+
+
+# Returns a dictionary with the marginal probabilities, the amplitudes (with phases) and the fidelity of the
+# reduced state of the n lowest qubits of statevector, a 1-D array (which can also be a memory-mapped file)
+def reduced_address_state(statevector, n, chunk_size=CHUNK_SIZE):
+    width = 2 ** n
+    rows = statevector.reshape(-1, width)
+    chunk_rows = max(1, chunk_size // width)
+
+    probabilities = np.zeros(width)
+    best_row, best_norm = None, -1.0
+    for start in range(0, rows.shape[0], chunk_rows):
+        chunk = np.asarray(rows[start:start + chunk_rows], dtype=complex)
+        weights = np.abs(chunk) ** 2
+        probabilities += weights.sum(axis=0)
+        norms = weights.sum(axis=1)
+        i = int(np.argmax(norms))
+        if norms[i] > best_norm:
+            best_row, best_norm = chunk[i].copy(), norms[i]
+    amplitudes = _fix_phase(best_row / np.sqrt(best_norm))
+
+    fidelity = 0.0
+    for start in range(0, rows.shape[0], chunk_rows):
+        chunk = np.asarray(rows[start:start + chunk_rows], dtype=complex)
+        fidelity += np.sum(np.abs(chunk @ amplitudes.conj()) ** 2)
+    return {'probabilities': probabilities / probabilities.sum(), 'amplitudes': amplitudes,
+            'fidelity': float(fidelity / probabilities.sum())}
+
+
+# Same as reduced_address_state, for a sparse state (see sparse_sim.py)
+def sparse_reduced_state(state, n):
+    width = 2 ** n
+    probabilities = np.zeros(width)
+    rows = {}
+    for basis, amp in state.items():
+        probabilities[basis % width] += abs(amp) ** 2
+        rows.setdefault(basis // width, np.zeros(width, dtype=complex))[basis % width] = amp
+    best_row = max(rows.values(), key=lambda row: np.sum(np.abs(row) ** 2))
+    amplitudes = _fix_phase(best_row / np.linalg.norm(best_row))
+    fidelity = sum(np.abs(row @ amplitudes.conj()) ** 2 for row in rows.values())
+    return {'probabilities': probabilities / probabilities.sum(), 'amplitudes': amplitudes,
+            'fidelity': float(fidelity / probabilities.sum())}
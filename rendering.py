@@ -0,0 +1,138 @@
+'''
+This file implements the rendering pipeline of the circuit diagrams in circuit_diagrams/. The circuit
+builders (QRAM, VC, ORACLE, DIF, SUP, SUP_2 and the overall circuit) only call request(), which does nothing
+unless rendering has been enabled, so no plotting happens on the hot path by default.
+
+Once enabled, each requested diagram is rendered either right away or by a background worker thread. A
+content hash of every rendered circuit (its title, gates and wiring) is kept in circuit_diagrams/hashes.json,
+and diagrams whose hash has not changed since they were last rendered are skipped.
+'''
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+
+
+DIAGRAM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'circuit_diagrams')
+HASH_FILE = os.path.join(DIAGRAM_DIR, 'hashes.json')
+
+_enabled = False
+_queue = None           # the queue of the background worker, None if rendering synchronously
+_lock = threading.Lock()
+_hashes = None          # the content hash of each rendered diagram, keyed by file name
+_requested = set()      # the file names rendered or queued since take_requested last returned them
+
+
+# Enables rendering; if background, diagrams are rendered by a worker thread instead of the caller
+def enable(background=False):
+    global _enabled, _queue
+    _enabled = True
+    if background and _queue is None:
+        _queue = queue.Queue()
+        threading.Thread(target=_work, daemon=True).start()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+# Waits until the background worker has rendered every requested diagram
+def wait():
+    if _queue is not None:
+        _queue.join()
+
+
+# Returns a hash of the content of the circuit: its title, and the name, label, parameters and
+# qubits of each instruction
+def circuit_hash(circuit, title):
+    digest = hashlib.sha256(title.encode())
+    index = {bit: i for i, bit in enumerate(circuit.qubits)}
+    digest.update(str(circuit.num_qubits).encode())
+    for op, qargs, _ in circuit.data:
+        digest.update(repr((op.name, getattr(op, 'label', None), [str(p) for p in op.params],
+                            [index.get(q) for q in qargs])).encode())
+    return digest.hexdigest()
+
+
+def _load_hashes():
+    global _hashes
+    if _hashes is None:
+        _hashes = {}
+        if os.path.exists(HASH_FILE):
+            with open(HASH_FILE) as f:
+                _hashes = json.load(f)
+    return _hashes
+
+
+def _is_current(filename, content_hash):
+    with _lock:
+        return (_load_hashes().get(filename) == content_hash
+                and os.path.exists(os.path.join(DIAGRAM_DIR, filename)))
+
+
+def _draw(circuit, title, filename, content_hash):
+    import matplotlib
+    matplotlib.use('Agg')       # headless, and safe to use from the worker thread
+    import matplotlib.pyplot as plt
+
+    fig = circuit.draw(output='mpl')
+    fig.suptitle(title)
+    os.makedirs(DIAGRAM_DIR, exist_ok=True)
+    fig.savefig(os.path.join(DIAGRAM_DIR, filename))
+    plt.close(fig)
+    with _lock:
+        _load_hashes()[filename] = content_hash
+        with open(HASH_FILE, 'w') as f:
+            json.dump(_hashes, f, indent=2, sort_keys=True)
+
+
+def _work():
+    while True:
+        circuit, title, filename, content_hash = _queue.get()
+        try:
+            if not _is_current(filename, content_hash):
+                _draw(circuit, title, filename, content_hash)
+        except Exception:       # e.g. matplotlib is missing; the worker must keep serving the queue for wait()
+            logging.getLogger(__name__).exception("Could not render circuit_diagrams/%s", filename)
+        finally:
+            _queue.task_done()
+
+
+# Renders the circuit into circuit_diagrams/filename right away (unless its content has not changed),
+# regardless of whether rendering is enabled
+def render(circuit, title, filename, force=False):
+    content_hash = circuit_hash(circuit, title)
+    if force or not _is_current(filename, content_hash):
+        _draw(circuit, title, filename, content_hash)
+
+
+# Called by the circuit builders: renders the diagram if rendering is enabled, otherwise does nothing
+def request(circuit, title, filename):
+    if not _enabled:
+        return
+    content_hash = circuit_hash(circuit, title)
+    if _is_current(filename, content_hash):
+        return
+    if _queue is None:
+        _draw(circuit, title, filename, content_hash)
+    else:
+        _queue.put((circuit.copy(), title, filename, content_hash))     # the caller may keep modifying it
+    with _lock:
+        _requested.add(filename)
+
+
+# Returns whether the diagram filename has been rendered or queued by request() since the last call, e.g. not
+# if its circuit came from the cache or its content has not changed
+def take_requested(filename):
+    with _lock:
+        requested = filename in _requested
+        _requested.discard(filename)
+    return requested
@@ -0,0 +1,236 @@
+'''
+This file implements a resource estimator for the circuit solving Task 1, and a planner choosing how to
+simulate it. Instead of running Grovers_test and watching it run out of memory (the 16 bytes * 2^30 of the
+Important Notes in the README), estimate_resources returns the qubit count, gate counts, depth and the
+projected memory of each simulation method, and plan_simulation chooses the cheapest feasible one within a
+memory budget, or refuses early with a clear report.
+
+The projections are upper bounds based on the structure of the circuit: only the H layers (and the other
+non-permutation gates) on the address and phase qubits create branching, so with k such qubits there are at
+most 2^k nonzero amplitudes, which also bounds the bond dimension of the matrix product state.
+'''
+
+import os
+from qiskit.circuit import ControlledGate
+
+
+SPARSE_ENTRY_BYTES = 200        # rough size of one entry of the sparse state (int key + complex amplitude)
+# gates that only permute the basis states or add phases to them, which do not create any branching
+NON_BRANCHING = {'x', 'y', 'z', 's', 'sdg', 't', 'tdg', 'p', 'u1', 'rz', 'cx', 'ccx', 'mcx', 'cz', 'cp', 'mcp',
+                 'swap', 'cswap', 'id', 'barrier', 'measure'}
+
+
+class InsufficientMemoryError(MemoryError):
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
+# Returns the memory that can be used for the simulation, in bytes
+def available_memory():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return 16 * 1024 ** 3       # like the PC this project was written on
+
+
+# Returns the number of qubits of each register of the circuit generated by Grovers_circuit:
+# the total number of qubits, and the number of qubits that branch (address and phase qubits)
+# If optimize, the m register of QRAM (and the unused bits of the tc register) is not counted, as optimize.py
+# removes it; check_qubit_counts compares this with the qubits optimize.py actually keeps
+# If exact, the circuit is the exact amplitude amplification of main.exact_circuit, without any phase qubit
+# If serial, the circuit is the divide-and-check engine of divide_check.py, with a class flag qubit if both
+# classes have solutions
+def count_qubits(input_vector, mode='bucket_brigade', optimize=False, exact=False, serial=False):
+    n = int(len(input_vector)).bit_length() - 1
+    m = int(max(input_vector)).bit_length()
+    if mode == 'qrom':
+        work = 1
+    elif optimize:
+        work = 2 ** n                   # tau register
+    else:
+        work = 2 ** n + m * 2 ** n      # tau and m registers
+    if mode == 'parallel':      # tc register, the copies of the t register (only the bits in use if optimize)
+        from oracle import parallel_copies, live_copy_qubits
+        copies = parallel_copies(n, m)
+        work += live_copy_qubits(input_vector, n, m, copies) if optimize else m * (copies - 1)
+    if exact:
+        return n + work + m, n
+    if serial:
+        from divide_check import class_counts
+        address = n + (1 if all(class_counts(input_vector).values()) else 0)     # the class flag
+        return address + work + m, address
+    if n == 1:
+        return 1, 1
+    if n == 2:      # from2to4.improve: b, a, work, t and j registers
+        return 2 + 2 + work + m + 2, 2 + 2 + 2
+    return n + work + m + 1, n + 1
+
+
+# Flattens the circuit down to X/CX/CCX/MCX and the other gates without definition (or standard 1-qubit gates)
+# Returns the list of (name, qubit indices); multi-controlled X gates are named after their number of controls
+def flatten(circuit):
+    index = {bit: i for i, bit in enumerate(circuit.qubits)}
+    ops = []
+
+    def expand(circ, qubits):
+        local = {bit: i for i, bit in enumerate(circ.qubits)}
+        for op, qargs, _ in circ.data:
+            q = [qubits[local[bit]] for bit in qargs]
+            if isinstance(op, ControlledGate) and op.base_gate.name == 'x':
+                k = op.num_ctrl_qubits
+                ops.append(({1: 'cx', 2: 'ccx'}.get(k, 'mcx'), q[:k + 1]))
+            elif op.definition is None or op.num_qubits == 1 or op.name in ('barrier', 'measure', 'unitary'):
+                ops.append((op.name, q))
+            else:
+                expand(op.definition, q)
+
+    expand(circuit, [index[bit] for bit in circuit.qubits])
+    return ops
+
+
+# Returns the gate counts and the depth of a flattened circuit
+def gate_statistics(ops):
+    counts = {}
+    levels = {}
+    depth = 0
+    for name, qubits in ops:
+        if name == 'barrier':
+            continue
+        counts[name] = counts.get(name, 0) + 1
+        level = max((levels.get(q, 0) for q in qubits), default=0) + 1
+        for q in qubits:
+            levels[q] = level
+        depth = max(depth, level)
+    return counts, depth
+
+
+# Returns the memory of the matrix product state of num_qubits qubits, in bytes: two matrices per qubit, with
+# the bond dimension bounded by 2^branching, or by the chain alone (2^(num_qubits // 2)) if branching is None,
+# which is the bound Aer checks the memory of an MPS simulation against
+def mps_memory(num_qubits, branching=None):
+    bond = 2 ** (num_qubits // 2 if branching is None else min(branching, num_qubits // 2))
+    return num_qubits * 2 * bond ** 2 * 16
+
+
+# Returns a report of the resources needed to simulate the circuit of input_vector
+# If circuit is None and count_gates, the circuit is built with Grovers_circuit to count its gates;
+# with count_gates=False, only the qubit counts and the memory projections (which are analytic) are reported
+# If optimize, the circuit is estimated after the pass in optimize.py; exact and serial are passed to
+# Grovers_circuit
+def estimate_resources(input_vector, mode='bucket_brigade', circuit=None, count_gates=True, optimize=False,
+                       exact=False, serial=False):
+    num_qubits, branching = count_qubits(input_vector, mode, optimize, exact, serial)
+    report = {'input_vector': list(input_vector), 'mode': mode, 'num_qubits': num_qubits,
+              'branching_qubits': branching}
+
+    if circuit is None and count_gates:
+        from main import Grovers_circuit
+        circuit, _ = Grovers_circuit(input_vector, mode, exact, serial=serial)
+        if optimize:
+            from optimize import optimize_circuit
+            circuit, _, _ = optimize_circuit(circuit, keep=range(int(len(input_vector)).bit_length() - 1))
+    if circuit is not None:
+        ops = flatten(circuit)
+        report['num_qubits'] = circuit.num_qubits
+        report['gate_counts'], report['depth'] = gate_statistics(ops)
+        report['branching_qubits'] = len({q for name, qubits in ops if name not in NON_BRANCHING for q in qubits})
+        num_qubits, branching = report['num_qubits'], report['branching_qubits']
+
+    report['memory'] = {
+        'statevector_single': 2 ** num_qubits * 8,
+        'statevector_double': 2 ** num_qubits * 16,
+        'density_matrix_single': 4 ** num_qubits * 8,
+        'density_matrix_double': 4 ** num_qubits * 16,
+        'matrix_product_state': mps_memory(num_qubits, branching),
+        'sparse': 2 ** branching * SPARSE_ENTRY_BYTES,
+    }
+    return report
+
+
+# The simulation configurations considered by the planner: (name, engine, Aer method, precision)
+# The matrix_product_state simulator runs through mps.py, which lays the qubits out along its chain and
+# cross-checks small inputs against the statevector simulator
+CONFIGURATIONS = [
+    ('sparse', 'sparse', None, None),
+    ('statevector_single', 'aer', 'statevector', 'single'),
+    ('statevector_double', 'aer', 'statevector', 'double'),
+    ('matrix_product_state', 'mps', 'matrix_product_state', None),
+]
+
+
+# Chooses the cheapest (in memory) configuration of the report that fits in budget bytes
+# (default: the available memory), among the configurations of the given method
+# ('auto' for all of them, or 'sparse' / 'statevector' / 'matrix_product_state')
+# If return_state, the statevector returned by Aer is also counted, as it is copied into the result
+# The configurations named in exclude are skipped (e.g. after the simulator rejected one of them)
+# Returns a dictionary with the engine, the Aer method and precision and the projected memory,
+# or raises InsufficientMemoryError if no configuration fits
+def plan_simulation(report, budget=None, method='auto', return_state=False, exclude=()):
+    if budget is None:
+        budget = available_memory()
+    candidates = []
+    for name, engine, aer_method, precision in CONFIGURATIONS:
+        if method not in ('auto', name, aer_method) or name in exclude:
+            continue
+        memory = report['memory'][name]
+        if engine == 'aer' and return_state:
+            memory *= 2
+        candidates.append((memory, name, engine, aer_method, precision))
+    if not candidates:
+        raise ValueError("Unknown simulation method '{}'".format(method))
+
+    memory, name, engine, aer_method, precision = min(candidates)
+    if memory > budget:
+        raise InsufficientMemoryError("No simulation method fits in {:.2f} GB:\n".format(budget / 1024 ** 3)
+                                      + format_report(report), report)
+    return {'name': name, 'engine': engine, 'method': aer_method, 'precision': precision, 'memory': memory}
+
+
+# Returns a human-readable version of the report
+def format_report(report):
+    lines = ["input_vector {} ({} mode): {} qubits, {} of them branching".format(
+        report['input_vector'], report['mode'], report['num_qubits'], report['branching_qubits'])]
+    if 'gate_counts' in report:
+        lines.append("gates: {}, depth: {}".format(report['gate_counts'], report['depth']))
+    for name, memory in report['memory'].items():
+        lines.append("    {:<24}{:>16.3f} GB".format(name, memory / 1024 ** 3))
+    return '\n'.join(lines)
+
+
+# Returns the (input_vector, mode, exact, serial, predicted, actual) cases where count_qubits(optimize=True)
+# differs from the number of qubits optimize_circuit keeps in the circuit of Grovers_circuit (empty if none)
+def check_qubit_counts(vectors, modes=('bucket_brigade', 'qrom', 'parallel'), exact=(False, True),
+                       serial=(False, True)):
+    from main import Grovers_circuit
+    from optimize import optimize_circuit
+    mismatches = []
+    for input_vector in vectors:
+        n = int(len(input_vector)).bit_length() - 1
+        for mode in modes:
+            for ex in exact:
+                for se in serial:
+                    if ex and se:
+                        continue
+                    circuit, _ = Grovers_circuit(input_vector, mode, ex, serial=se)
+                    _, _, optimized = optimize_circuit(circuit, keep=range(n))
+                    predicted = count_qubits(input_vector, mode, optimize=True, exact=ex, serial=se)[0]
+                    if predicted != optimized['qubits_after']:
+                        mismatches.append((list(input_vector), mode, ex, se, predicted, optimized['qubits_after']))
+    return mismatches
+
+
+if __name__ == '__main__':
+    mismatches = check_qubit_counts([[1, 5, 7, 10], [3, 6, 5, 2], [5, 10, 21, 42, 0, 1, 2, 3],
+                                     [2, 5, 1, 1, 3, 10, 4, 4], [1, 2, 5, 7, 0, 3, 2, 1]])
+    print("qubit counts:", "all match optimize.py" if not mismatches else mismatches)
+    report = estimate_resources([1, 5, 7, 10])
+    print(format_report(report))
+    print(plan_simulation(report))
@@ -0,0 +1,157 @@
+'''
+This file implements a sparse simulator for the circuits generated in this repository. The QRAM is built
+almost entirely from X, CX and CCX gates, which only permute basis states, and only the H layers on the
+address and phase qubits create branching. Hence the number of basis states with a nonzero amplitude stays
+small during the whole simulation (around 2^(n+2)), even though a dense statevector of the same circuit
+would need 2^30 amplitudes or more.
+
+The state is stored as a dictionary that maps each basis state (an integer, where qubit 0 is the least
+significant bit, following the Qiskit convention) to its complex amplitude. Gates are applied directly on
+this dictionary: X/CX/CCX/MCX just relabel the keys, and any other gate is applied through its (small)
+matrix on each group of basis states it mixes.
+'''
+
+import random
+import numpy as np
+from qiskit.circuit import ControlledGate
+from qiskit.quantum_info import Operator
+
+
+TOLERANCE = 1e-12       # amplitudes smaller than this are dropped from the state
+SKIPPED = {'barrier', 'delay', 'measure'}       # instructions that do not change the state
+
+
+# applies a phase factor to every basis state satisfying the control condition
+# a basis state satisfies the condition if (basis & cmask) == cval
+def _apply_phase(state, factor, cmask=0, cval=0):
+    return {basis: (amp * factor if basis & cmask == cval else amp) for basis, amp in state.items()}
+
+
+# applies a 2^k x 2^k matrix on the k given qubits (qubits[0] being the least significant one,
+# like Operator in Qiskit), only to basis states satisfying the control condition
+def _apply_matrix(state, matrix, qubits, cmask=0, cval=0):
+    k = len(qubits)
+    mask = 0
+    for q in qubits:
+        mask |= 1 << q
+    # spread[i] is the local index i written onto the positions of the given qubits
+    spread = []
+    for i in range(2 ** k):
+        bits = 0
+        for j in range(k):
+            if (i >> j) & 1:
+                bits |= 1 << qubits[j]
+        spread.append(bits)
+    position = {bits: i for i, bits in enumerate(spread)}
+
+    new_state = {}
+    for basis, amp in state.items():
+        if basis & cmask != cval:
+            new_state[basis] = new_state.get(basis, 0) + amp
+            continue
+        col = position[basis & mask]
+        rest = basis & ~mask
+        for row in range(2 ** k):
+            coeff = matrix[row, col]
+            if coeff != 0:
+                target = rest | spread[row]
+                new_state[target] = new_state.get(target, 0) + coeff * amp
+    return {basis: amp for basis, amp in new_state.items() if abs(amp) > TOLERANCE}
+
+
+# applies the instruction op on the given qubits (global indices), controlled by the condition (cmask, cval)
+def _apply(state, op, qubits, cmask=0, cval=0):
+    name = op.name
+    if name in SKIPPED or name.startswith('save_'):
+        return state
+
+    if isinstance(op, ControlledGate):
+        # the controls are folded into the condition, and the base gate is applied on the following qubits
+        # (any qubits left after those, e.g. the ancillas of a v-chain MCX, are restored by construction)
+        n_ctrl = op.num_ctrl_qubits
+        for i in range(n_ctrl):
+            bit = 1 << qubits[i]
+            cmask |= bit
+            if (op.ctrl_state >> i) & 1:
+                cval |= bit
+        return _apply(state, op.base_gate, qubits[n_ctrl:n_ctrl + op.base_gate.num_qubits], cmask, cval)
+
+    if name == 'x':         # the permutation gate, simply relabels the basis states
+        bit = 1 << qubits[0]
+        return {(basis ^ bit if basis & cmask == cval else basis): amp for basis, amp in state.items()}
+
+    if name in ('reset', 'initialize'):
+        raise ValueError("The sparse simulator only supports unitary circuits, got '{}'".format(name))
+
+    if op.definition is None or op.num_qubits == 1 or name == 'unitary':
+        return _apply_matrix(state, Operator(op).data, qubits, cmask, cval)
+
+    # otherwise, go through the definition of the gate
+    definition = op.definition
+    index = {bit: i for i, bit in enumerate(definition.qubits)}
+    if definition.global_phase:
+        state = _apply_phase(state, np.exp(1j * float(definition.global_phase)), cmask, cval)
+    for inner, qargs, _ in definition.data:
+        state = _apply(state, inner, [qubits[index[q]] for q in qargs], cmask, cval)
+    return state
+
+
+# Runs the circuit starting from |00...0> (or from initial_state, a dictionary of basis state -> amplitude)
+# Returns the final sparse state and a dictionary that maps each measured classical bit to its qubit
+# Measurements are assumed to be at the end of the circuit, as in Grovers_test
+def sparse_run(circuit, initial_state=None):
+    q_index = {bit: i for i, bit in enumerate(circuit.qubits)}
+    c_index = {bit: i for i, bit in enumerate(circuit.clbits)}
+    state = dict(initial_state) if initial_state is not None else {0: 1 + 0j}
+    if circuit.global_phase:
+        state = _apply_phase(state, np.exp(1j * float(circuit.global_phase)))
+
+    measured = {}
+    for op, qargs, cargs in circuit.data:
+        if op.name == 'measure':
+            measured[c_index[cargs[0]]] = q_index[qargs[0]]
+            continue
+        state = _apply(state, op, [q_index[q] for q in qargs])
+    return state, measured
+
+
+# Returns the probability of each outcome of the measured qubits, keyed by bitstrings in the same
+# format as the counts of AerSimulator (classical bit 0 being the rightmost character)
+def sparse_probabilities(state, measured, num_clbits):
+    probs = {}
+    for basis, amp in state.items():
+        outcome = ['0'] * num_clbits
+        for clbit, qubit in measured.items():
+            if (basis >> qubit) & 1:
+                outcome[num_clbits - 1 - clbit] = '1'
+        key = ''.join(outcome)
+        probs[key] = probs.get(key, 0) + abs(amp) ** 2
+    return probs
+
+
+# Samples n_shots outcomes of the measured qubits, returning counts like result.get_counts() in Aer
+def sparse_counts(state, measured, num_clbits, n_shots, seed=None):
+    probs = sparse_probabilities(state, measured, num_clbits)
+    outcomes = sorted(probs)
+    rng = random.Random(seed)
+    counts = {}
+    for outcome in rng.choices(outcomes, weights=[probs[o] for o in outcomes], k=n_shots):
+        counts[outcome] = counts.get(outcome, 0) + 1
+    return counts
+
+
+# Returns the state of the n address qubits (qubit 0~n-1) in the same form as Grovers_test,
+# i.e. the square root of the diagonal of the reduced density matrix
+def address_state(state, n, decimals=3):
+    probs = np.zeros(2 ** n)
+    for basis, amp in state.items():
+        probs[basis & (2 ** n - 1)] += abs(amp) ** 2
+    return np.round(np.sqrt(probs), decimals)
+
+
+# Converts a (small) sparse state into a dense statevector of num_qubits qubits
+def to_dense(state, num_qubits):
+    dense = np.zeros(2 ** num_qubits, dtype=complex)
+    for basis, amp in state.items():
+        dense[basis] = amp
+    return dense
@@ -0,0 +1,135 @@
+'''
+This file implements a long-lived worker that answers repeated solve requests, for callers that would
+otherwise pay the import of qiskit and Aer and the construction of the circuits on every invocation. The
+worker imports everything and starts the simulator once (warm_up), keeps the built and transpiled circuits in
+the in-memory tier of the circuit cache, and then answers each request in the same process.
+
+Requests and responses are JSON lines. A request is an input vector, either as a JSON list ([1, 5, 7, 10]),
+integers separated by spaces or commas, or a JSON object with an 'input_vector' field and optionally 'id',
+'state', 'shots', 'method', 'mode', 'exact' and 'serial' (the options of Grovers_test). The response holds the
+'counts' (or the final address 'state', as [real, imaginary] pairs), the 'status' ('ok' or 'error') and the
+'elapsed' time in seconds.
+
+Usage:
+    python main.py --worker                      (requests on stdin, responses on stdout)
+    python main.py --worker --socket /tmp/grover.sock
+    python main.py --worker --port 5050          (localhost only)
+
+python worker.py runs smoke_test, which starts a worker and sends it one request.
+'''
+
+import contextlib
+import io
+import json
+import os
+import socketserver
+import subprocess
+import sys
+import time
+
+
+OPTIONS = {'state': 'return_state', 'shots': 'n_shots', 'method': 'method', 'mode': 'mode', 'exact': 'exact',
+           'serial': 'serial'}
+
+
+# Parses a request line into (id, input_vector, options of Grovers_test)
+def parse_request(line, index=None):
+    line = line.strip()
+    if line.startswith('[') or line.startswith('{'):
+        data = json.loads(line)
+        if isinstance(data, dict):
+            options = {OPTIONS[key]: value for key, value in data.items() if key in OPTIONS}
+            return data.get('id', index), [int(v) for v in data['input_vector']], options
+        return index, [int(v) for v in data], {}
+    return index, [int(v) for v in line.replace(',', ' ').split()], {}
+
+
+# Imports the solve path and runs a small circuit once, so that the first request does not pay for the
+# start-up of Aer; vectors are solved once to warm the circuit cache for them
+def warm_up(vectors=()):
+    import main
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.Grovers_test([1, 5, 7, 10], method='statevector', n_shots=1)
+        for vector in vectors:
+            main.Grovers_test(vector, n_shots=1)
+
+
+# Answers the request line, returning the JSON response line
+def handle(line, index=None):
+    from main import Grovers_test
+    start = time.perf_counter()
+    job_id = index
+    try:
+        job_id, input_vector, options = parse_request(line, index)
+        with contextlib.redirect_stdout(io.StringIO()):     # Grovers_test reports to stdout
+            output = Grovers_test(input_vector, **options)
+        if options.get('return_state'):
+            record = {'id': job_id, 'status': 'ok', 'state': [[float(amp.real), float(amp.imag)] for amp in output]}
+        else:
+            record = {'id': job_id, 'status': 'ok', 'counts': dict(output)}
+    except Exception as error:      # report the failure and keep serving
+        record = {'id': job_id, 'status': 'error', 'error': repr(error)}
+    record['elapsed'] = time.perf_counter() - start
+    return json.dumps(record)
+
+
+# Answers every request line of source, writing the responses to output as soon as they are ready
+def serve_lines(source, output):
+    for index, line in enumerate(source):
+        if line.strip():
+            output.write(handle(line, index) + '\n')
+            output.flush()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for index, line in enumerate(self.rfile):
+            line = line.decode()
+            if line.strip():
+                self.wfile.write((handle(line, index) + '\n').encode())
+                self.wfile.flush()
+
+
+# Runs the worker on stdin/stdout, on the Unix socket at path socket_path, or on localhost:port
+# Requests are answered one at a time, in the order they arrive
+def serve(socket_path=None, port=None, warm_vectors=()):
+    warm_up(warm_vectors)
+    if socket_path is None and port is None:
+        serve_lines(sys.stdin, sys.stdout)
+        return
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = socketserver.UnixStreamServer(socket_path, _Handler)
+    else:
+        server = socketserver.TCPServer(('127.0.0.1', port), _Handler)
+    print("Worker ready on {}.".format(socket_path or '127.0.0.1:{}'.format(port)), file=sys.stderr)
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    if socket_path is not None and os.path.exists(socket_path):
+        os.remove(socket_path)
+
+
+# Starts a worker in a subprocess (python main.py --worker), sends it one request on stdin and checks that
+# the response solves input_vector, whose solutions are expected
+# Returns the response
+def smoke_test(input_vector=(1, 5, 7, 10), expected=('01', '11'), timeout=600):
+    main_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    request = json.dumps({'id': 'smoke', 'input_vector': list(input_vector), 'shots': 1000, 'method': 'sparse'})
+    process = subprocess.run([sys.executable, main_path, '--worker'], input=request + '\n', capture_output=True,
+                             text=True, timeout=timeout)
+    if process.returncode != 0:
+        raise RuntimeError("The worker exited with code {}:\n{}".format(process.returncode, process.stderr))
+    response = json.loads(process.stdout.strip().splitlines()[-1])
+    if response['status'] != 'ok' or response['id'] != 'smoke':
+        raise RuntimeError("Unexpected response: {}".format(response))
+    if sorted(response['counts']) != sorted(expected):
+        raise RuntimeError("Expected the solutions {}, got {}".format(sorted(expected), response['counts']))
+    return response
+
+
+if __name__ == '__main__':
+    print(smoke_test())